@@ -0,0 +1,417 @@
+#-*- coding: utf-8 -*-
+
+"""Benchmarks for pyDBCLI, run against generated SQLite databases.
+
+Each benchmark runs in a child process of its own, so the peak memory
+(ru_maxrss) reported is its own, and results are written as JSON lines
+so runs can be compared between releases, e.g.:
+
+    python benchmarks/bench.py -o before.jsonl
+    python benchmarks/bench.py -o after.jsonl -k query
+
+The ODBC extra is benchmarked through the fake pyodbc module in
+benchmarks/fake_pyodbc, which is backed by sqlite3.
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import os
+import sys
+import time
+import json
+import getopt
+import random
+import sqlite3
+import platform
+import resource
+import tempfile
+import subprocess
+from fnmatch import fnmatchcase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_PYODBC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_pyodbc')
+
+# Row counts of the generated tables, --full adds the larger ones
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+FULL_SIZES = SIZES + [10 ** 6, 10 ** 7]
+# Nr. of columns in the wide table
+WIDE_COLUMNS = 50
+# Nr. of tables (of 10 columns each) in the many-table schemas
+SCHEMA_SIZES = [100, 1000]
+FULL_SCHEMA_SIZES = SCHEMA_SIZES + [10000]
+# Nr. of statements/commands dispatched by the statement benchmarks
+STATEMENTS = 10000
+# Nr. of processes started by the startup benchmarks
+STARTS = 20
+
+
+def generate(path, kind, size):
+        """Create a SQLite database at path for kind of benchmark, one of
+        narrow (4 columns), wide (WIDE_COLUMNS columns) or schema (size
+        empty tables), unless it already exists.
+        """
+        if os.path.exists(path):
+                return path
+        tmp = path + '.tmp'
+        if os.path.exists(tmp):
+                os.remove(tmp)
+        conn = sqlite3.connect(tmp)
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        rand = random.Random(size)
+        if kind == 'narrow':
+                conn.execute('CREATE TABLE narrow (id INTEGER PRIMARY KEY, name TEXT, score REAL, created TEXT)')
+                conn.executemany('INSERT INTO narrow VALUES (?, ?, ?, ?)', (
+                        (i, 'name %d' % (i,), rand.random() * 1000,
+                         '2020-01-%02d 12:00:00' % (i % 28 + 1,))
+                        for i in xrange(size)))
+        elif kind == 'wide':
+                columns = ['c%d' % (i,) for i in range(1, WIDE_COLUMNS)]
+                conn.execute('CREATE TABLE wide (id INTEGER PRIMARY KEY, %s)' % (
+                        ', '.join('%s %s' % (c, i % 2 and 'TEXT' or 'INTEGER') for (i, c) in enumerate(columns)),))
+                conn.executemany('INSERT INTO wide VALUES (%s)' % (', '.join('?' * WIDE_COLUMNS),), (
+                        [i] + [j % 2 and 'v%d' % (i + j,) or i * j for j in range(len(columns))]
+                        for i in xrange(size)))
+        elif kind == 'schema':
+                for i in xrange(size):
+                        conn.execute('CREATE TABLE t%05d (id INTEGER PRIMARY KEY, %s)' % (
+                                i, ', '.join('col%d_%d TEXT' % (i, j) for j in range(9)),))
+        else:
+                raise ValueError('Unknown kind %s' % (kind,))
+        conn.commit()
+        conn.close()
+        os.rename(tmp, path)
+        return path
+
+
+def database(data_dir, kind, size):
+        return generate(os.path.join(data_dir, '%s-%d.db' % (kind, size)), kind, size)
+
+
+def lite_utility(path, **attrs):
+        from pyDBCLI.extras.litecli import LiteUtility
+        u = LiteUtility()
+        for name, value in attrs.items():
+                setattr(u, name, value)
+        if not u.connect(path):
+                raise RuntimeError('Could not connect to %s' % (path,))
+        return u
+
+
+def odbc_utility(path, **attrs):
+        sys.path.insert(0, FAKE_PYODBC)
+        from pyDBCLI.extras.odbc import ODBCUtility
+        u = ODBCUtility()
+        u.query = 'DATABASE=%s' % (path,)
+        for name, value in attrs.items():
+                setattr(u, name, value)
+        if not u.connect(''):
+                raise RuntimeError('Could not connect to %s' % (path,))
+        return u
+
+
+# Benchmarks, each is passed its params and returns a tuple of a
+# function to time and the nr. of operations (and their unit) it does
+
+def bench_query(params):
+        """Run a SELECT through run_query(), rendering in a format.
+        """
+        connect = params.get('backend') == 'odbc' and odbc_utility or lite_utility
+        u = connect(params['db'], output_format=params['format'],
+                    background_queries=params['background'])
+        sql = 'SELECT * FROM %s' % (params['kind'],)
+        return lambda: u.run_query(sql), params['size'], 'rows'
+
+
+def bench_render(params):
+        """Render rows already in memory with print_table().
+        """
+        from pyDBCLI.helpers import print_table
+        u = lite_utility(params['db'])
+        r = u.cursor.execute('SELECT * FROM %s' % (params['kind'],))
+        rows = [[d[0] for d in r.description]] + [list(row) for row in r.fetchall()]
+        u.cursor.connection.close()
+        return lambda: print_table(rows), params['size'], 'rows'
+
+
+def bench_export(params):
+        """Export a table to a file with \\export.
+        """
+        u = lite_utility(params['db'])
+        path = os.path.join(params['tmp_dir'], 'export.%s' % (params['format'],))
+        line = '%s SELECT * FROM %s' % (path, params['kind'],)
+        return lambda: u.do_export(line), params['size'], 'rows'
+
+
+def bench_statements(params):
+        """Feed single line statements through the prompt's dispatch
+        (onecmd(), parseline() and default()).
+        """
+        u = lite_utility(params['db'], background_queries=params['background'])
+        lines = ['SELECT %d;' % (i,) for i in range(params['size'])]
+        def run():
+                for line in lines:
+                        u.onecmd(u.precmd(line))
+        return run, params['size'], 'statements'
+
+
+def bench_parseline(params):
+        """Split special commands and SQL with parseline().
+        """
+        u = lite_utility(params['db'])
+        lines = ['\\d narrow', 'SELECT * FROM narrow;', '\\format csv', 'id, name FROM narrow']
+        lines = (lines * (params['size'] // len(lines) + 1))[:params['size']]
+        def run():
+                for line in lines:
+                        u.parseline(line)
+        return run, params['size'], 'lines'
+
+
+def bench_metadata_load(params):
+        """Load the schema model with a cold metadata cache, as the first
+        \\d of a session does.
+        """
+        connect = params.get('backend') == 'odbc' and odbc_utility or lite_utility
+        u = connect(params['db'])
+        def run():
+                u.data_cache.clear()
+                u.get_tables()
+        return run, params['size'], 'tables'
+
+
+def bench_metadata_lookup(params):
+        """Describe every table with get_columns(), from the memoized
+        schema model.
+        """
+        u = lite_utility(params['db'])
+        tables = [row[0] for row in u.get_tables()[1:]]
+        def run():
+                for table in tables:
+                        u.get_columns(table)
+        return run, len(tables), 'tables'
+
+
+def bench_complete(params):
+        """Tab complete column and table names.
+        """
+        u = lite_utility(params['db'])
+        u.completer.load(u.get_schema_model())
+        prefixes = ['col%d' % (i,) for i in range(0, params['size'], 7)]
+        def run():
+                for prefix in prefixes:
+                        u.completedefault(prefix, 'SELECT %s' % (prefix,), 7, 7 + len(prefix))
+                        u.completedefault('t', 'SELECT * FROM t', 14, 15)
+        return run, len(prefixes) * 2, 'completions'
+
+
+def bench_startup(params):
+        """Start the pydbcli command and run a statement, in a new process
+        each time, from cold start to exit.
+        """
+        env = dict(os.environ)
+        path = [ROOT]
+        if params['backend'] == 'odbc':
+                path.insert(0, FAKE_PYODBC)
+        env['PYTHONPATH'] = os.pathsep.join(path + [env.get('PYTHONPATH', '')])
+        option = params['backend'] == 'odbc' and '-d' or '-f'
+        args = [sys.executable, '-m', 'pyDBCLI.cli', params['backend'], option, params['db'], '-e', 'SELECT 1;']
+        devnull = open(os.devnull, 'w')
+        def run():
+                for i in range(params['size']):
+                        subprocess.check_call(args, env=env, stdout=devnull)
+        return run, params['size'], 'starts'
+
+
+BENCHMARKS = {
+        'query': bench_query,
+        'render': bench_render,
+        'export': bench_export,
+        'statements': bench_statements,
+        'parseline': bench_parseline,
+        'metadata_load': bench_metadata_load,
+        'metadata_lookup': bench_metadata_lookup,
+        'complete': bench_complete,
+        'startup': bench_startup,
+}
+
+
+def plan(full=False):
+        """Returns a list of (benchmark name, params) to run.
+        """
+        sizes = full and FULL_SIZES or SIZES
+        schema_sizes = full and FULL_SCHEMA_SIZES or SCHEMA_SIZES
+        runs = []
+        for size in sizes:
+                for format in ('aligned', 'csv', 'jsonl'):
+                        runs.append(('query', dict(kind='narrow', size=size, format=format, background=True)))
+                runs.append(('query', dict(kind='narrow', size=size, format='aligned', background=False)))
+                runs.append(('query', dict(kind='narrow', size=size, format='csv', background=True, backend='odbc')))
+                runs.append(('export', dict(kind='narrow', size=size, format='csv')))
+                runs.append(('export', dict(kind='narrow', size=size, format='csv.gz')))
+                if size <= 10 ** 6:
+                        runs.append(('query', dict(kind='wide', size=size, format='aligned', background=True)))
+                        runs.append(('export', dict(kind='wide', size=size, format='jsonl')))
+                if size <= 10 ** 5:
+                        runs.append(('render', dict(kind='narrow', size=size)))
+        for background in (True, False):
+                runs.append(('statements', dict(kind='narrow', size=STATEMENTS, db_size=SIZES[0],
+                                                background=background)))
+        runs.append(('parseline', dict(kind='narrow', size=STATEMENTS * 10, db_size=SIZES[0])))
+        for backend in ('sqlite', 'odbc'):
+                runs.append(('startup', dict(kind='narrow', size=STARTS, db_size=SIZES[0], backend=backend)))
+        for size in schema_sizes:
+                runs.append(('metadata_load', dict(kind='schema', size=size)))
+                runs.append(('metadata_load', dict(kind='schema', size=size, backend='odbc')))
+                runs.append(('metadata_lookup', dict(kind='schema', size=size)))
+                runs.append(('complete', dict(kind='schema', size=size)))
+        return runs
+
+
+def run_child(spec):
+        """Run a single benchmark in this process, returning its result.
+        Output is sent to /dev/null so terminal speed isn't measured.
+        """
+        params = spec['params']
+        setup = BENCHMARKS[spec['name']]
+        fn, ops, unit = setup(params)
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        times = []
+        for i in range(spec['repeat']):
+                started = time.time()
+                fn()
+                times.append(time.time() - started)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        seconds = min(times)
+        return {
+                'seconds': seconds,
+                'times': times,
+                'ops': ops,
+                'unit': unit,
+                'ops_per_sec': ops / (seconds or 1e-9),
+                'peak_rss_kb': peak,
+                'rss_growth_kb': peak - baseline,
+        }
+
+
+def child_main(spec):
+        sys.path.insert(0, ROOT)
+        out = os.fdopen(os.dup(1), 'w')
+        os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+        result = run_child(spec)
+        sys.stdout.flush()
+        json.dump(result, out)
+        out.close()
+
+
+def environment():
+        sys.path.insert(0, ROOT)
+        from pyDBCLI.utils import __version__ as version
+        try:
+                commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                                 stderr=open(os.devnull, 'w')).strip()
+        except (OSError, subprocess.CalledProcessError):
+                commit = None
+        return {
+                'version': version,
+                'commit': commit,
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+        }
+
+
+# Shell script usage instrunctions, pushed to stdout
+# by usage()
+USAGE_MESSAGE = """pyDBCLI benchmarks
+Usage: bench.py [-o <file>] [-k <pattern>] [--full]
+
+Options:
+    -o, --output : File to append JSON lines results to (default STDOUT)
+    -k, --keyword : Only run benchmarks whose name matches this glob, e.g. 'query*'
+    -r, --repeat : Nr. of times each benchmark is timed, the fastest is kept
+                   (default 3)
+    -d, --data-dir : Directory to keep generated databases in, they're reused
+                     between runs (default in the system temp directory)
+    -l, --list : List the benchmarks that would be run
+    --full : Also run the 10^6 and 10^7 row and 10000 table sizes
+"""
+
+
+def main(argv):
+        try:
+                opts, args = getopt.getopt(argv, "o:k:r:d:lh",
+                                           ["output=", "keyword=", "repeat=", "data-dir=", "list", "full",
+                                            "help", "child="])
+        except getopt.GetoptError:
+                print >> sys.stderr, USAGE_MESSAGE
+                sys.exit(1)
+
+        output = None
+        keyword = None
+        repeat = 3
+        data_dir = os.path.join(tempfile.gettempdir(), 'pydbcli-bench')
+        full = False
+        listing = False
+        for opt, arg in opts:
+                if opt == '--child':
+                        child_main(json.loads(arg))
+                        return
+                elif opt in ('-o', '--output'):
+                        output = arg
+                elif opt in ('-k', '--keyword'):
+                        keyword = arg
+                elif opt in ('-r', '--repeat'):
+                        repeat = int(arg)
+                elif opt in ('-d', '--data-dir'):
+                        data_dir = arg
+                elif opt in ('-l', '--list'):
+                        listing = True
+                elif opt == '--full':
+                        full = True
+                elif opt in ('-h', '--help'):
+                        print >> sys.stdout, USAGE_MESSAGE
+                        return
+
+        runs = [(name, params) for (name, params) in plan(full)
+                if keyword is None or fnmatchcase(name, keyword)]
+        if listing:
+                for name, params in runs:
+                        print >> sys.stdout, name, json.dumps(params, sort_keys=True)
+                return
+
+        if not os.path.isdir(data_dir):
+                os.makedirs(data_dir)
+        tmp_dir = tempfile.mkdtemp(prefix='pydbcli-bench-')
+        env = environment()
+        out = output and open(output, 'a') or sys.stdout
+        failed = 0
+        for name, params in runs:
+                params = dict(params)
+                print >> sys.stderr, "%s %s ..." % (name, json.dumps(params, sort_keys=True)),
+                params['db'] = database(data_dir, params['kind'], params.get('db_size', params['size']))
+                params['tmp_dir'] = tmp_dir
+                spec = {'name': name, 'params': params, 'repeat': repeat}
+                child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', json.dumps(spec)],
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stdout, stderr = child.communicate()
+                record = {'benchmark': name}
+                record['params'] = dict((k, v) for (k, v) in params.items() if k not in ('db', 'tmp_dir'))
+                if child.returncode:
+                        failed += 1
+                        record['error'] = 'exit status %d' % (child.returncode,)
+                        print >> sys.stderr, "failed\n%s" % (stderr,)
+                else:
+                        record.update(json.loads(stdout))
+                        print >> sys.stderr, "%.3fs, %.0f %s/s, %d KB peak" % (
+                                record['seconds'], record['ops_per_sec'], record['unit'], record['peak_rss_kb'],)
+                record.update(env)
+                print >> out, json.dumps(record, sort_keys=True)
+                out.flush()
+        for f in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, f))
+        os.rmdir(tmp_dir)
+        sys.exit(failed and 1 or 0)
+
+if __name__ == "__main__":
+        main(sys.argv[1:])
@@ -0,0 +1,136 @@
+#-*- coding: utf-8 -*-
+
+"""Stand-in for the parts of the pyodbc API used by pyDBCLI.extras.odbc,
+backed by sqlite3, so the ODBC extra can be benchmarked without an ODBC
+driver. Put this directory first on sys.path to use it.
+The connection string is the path of a SQLite file, optionally given
+as DATABASE=<path>.
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import sqlite3
+
+version = '4.0.0-fake'
+
+Error = sqlite3.Error
+DatabaseError = sqlite3.DatabaseError
+ProgrammingError = sqlite3.ProgrammingError
+
+
+class Row(tuple):
+        """Tuple whose values can also be read as attributes named after
+        the cursor's columns, like pyodbc.Row.
+        """
+        __slots__ = ()
+        names = {}
+
+        def __getattr__(self, name):
+                try:
+                        return self[self.names[name]]
+                except KeyError:
+                        raise AttributeError(name)
+
+
+def row_class(description):
+        names = dict((d[0], i) for (i, d) in enumerate(description or ()))
+        return type('Row', (Row,), {'__slots__': (), 'names': names})
+
+
+class Cursor(object):
+
+        def __init__(self, connection):
+                self.connection = connection
+                self._cursor = connection._conn.cursor()
+                self._row = Row
+                self.fast_executemany = False
+
+        @property
+        def description(self):
+                return self._cursor.description
+
+        @property
+        def rowcount(self):
+                return self._cursor.rowcount
+
+        def execute(self, sql, *params):
+                if len(params) == 1 and isinstance(params[0], (list, tuple)):
+                        params = params[0]
+                self._cursor.execute(sql, params)
+                self._row = row_class(self._cursor.description)
+                return self
+
+        def executemany(self, sql, seq_of_params):
+                self._cursor.executemany(sql, seq_of_params)
+                return self
+
+        def fetchone(self):
+                row = self._cursor.fetchone()
+                return row is not None and self._row(row) or None
+
+        def fetchmany(self, size=1):
+                return map(self._row, self._cursor.fetchmany(size))
+
+        def fetchall(self):
+                return map(self._row, self._cursor.fetchall())
+
+        def tables(self, table=None, catalog=None, schema=None, tableType=None):
+                types = [t.strip().strip("'").lower() for t in (tableType or 'TABLE,VIEW').split(',')]
+                sql = ("SELECT NULL AS table_cat, NULL AS table_schem, name AS table_name,"
+                       " upper(type) AS table_type, NULL AS remarks FROM sqlite_master"
+                       " WHERE type IN (%s) AND name NOT LIKE 'sqlite_%%'" % (
+                               ', '.join('?' for t in types),))
+                params = types
+                if table is not None:
+                        sql += " AND name = ?"
+                        params = types + [table]
+                return self.execute(sql + " ORDER BY name", params)
+
+        def columns(self, table=None, catalog=None, schema=None, column=None):
+                sql = ("SELECT NULL AS table_cat, NULL AS table_schem, m.name AS table_name,"
+                       " p.name AS column_name, p.type AS type_name, NULL AS column_size,"
+                       " NOT p.\"notnull\" AS nullable, p.cid + 1 AS ordinal_position"
+                       " FROM sqlite_master m JOIN pragma_table_info(m.name) p"
+                       " WHERE m.type IN ('table', 'view')")
+                params = []
+                if table is not None:
+                        sql += " AND m.name = ?"
+                        params.append(table)
+                if column is not None:
+                        sql += " AND p.name = ?"
+                        params.append(column)
+                return self.execute(sql + " ORDER BY m.name, p.cid", params)
+
+        def cancel(self):
+                self.connection._conn.interrupt()
+
+        def close(self):
+                self._cursor.close()
+
+
+class Connection(object):
+
+        def __init__(self, path):
+                self._conn = sqlite3.connect(path, check_same_thread=False)
+
+        def cursor(self):
+                return Cursor(self)
+
+        def commit(self):
+                self._conn.commit()
+
+        def rollback(self):
+                self._conn.rollback()
+
+        def close(self):
+                self._conn.close()
+
+
+def connect(connstring, autocommit=False, **kwargs):
+        path = connstring
+        for part in connstring.split(';'):
+                key, sep, value = part.partition('=')
+                if sep and key.strip().upper() == 'DATABASE':
+                        path = value.strip()
+        return Connection(path)
@@ -0,0 +1,120 @@
+#-*- coding: utf-8 -*-
+
+"""Bulk loading helpers for pyDBCLI, used by \\import
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import csv
+import gzip
+import json
+from collections import OrderedDict
+
+
+def open_file(path, mode='rb'):
+        """Open a file, transparently (de)compressing it if it ends .gz
+        """
+        if path.endswith('.gz'):
+                return gzip.open(path, mode)
+        return open(path, mode)
+
+def file_format(path):
+        """Guess the format of a data file from its extension, one of
+        csv, tsv or jsonl.
+        """
+        if path.endswith('.gz'):
+                path = path[:-3]
+        ext = path.rsplit('.', 1)[-1].lower()
+        if ext in ('json', 'jsonl', 'ndjson'):
+                return 'jsonl'
+        if ext in ('tsv', 'tab'):
+                return 'tsv'
+        return 'csv'
+
+def read_rows(f, format='csv'):
+        """Read rows from an open CSV/TSV file (with a header row) or JSON
+        Lines file, returning a tuple of the column names and an iterator
+        of rows. CSV values are returned as strings, JSON values as decoded.
+        """
+        if format == 'jsonl':
+                lines = (line for line in f if line.strip())
+                try:
+                        first = json.loads(next(lines), object_pairs_hook=OrderedDict)
+                except StopIteration:
+                        return [], iter(())
+                columns = first.keys()
+                def rows():
+                        yield first.values()
+                        for line in lines:
+                                obj = json.loads(line)
+                                yield [obj.get(c) for c in columns]
+                return columns, rows()
+
+        reader = csv.reader(f, dialect=(format == 'tsv' and 'excel-tab' or 'excel'))
+        try:
+                columns = [c.decode('utf-8') for c in next(reader)]
+        except StopIteration:
+                return [], iter(())
+        return columns, reader
+
+def _parses(convert, values):
+        for v in values:
+                try:
+                        convert(v)
+                except (TypeError, ValueError):
+                        return False
+        return True
+
+def infer_types(columns, sample):
+        """Infer a Python type for each column from a sample of rows,
+        suitable for looking up in Utility.db_types.
+        Strings are inferred as int or float if every non-empty value
+        parses as one.
+        """
+        types = []
+        for i in range(len(columns)):
+                values = [row[i] for row in sample if i < len(row) and row[i] not in (None, '')]
+                if not values:
+                        types.append(unicode)
+                        continue
+                kinds = set(type(v) for v in values)
+                if kinds <= set([bool]):
+                        types.append(bool)
+                elif kinds <= set([int, long, bool]):
+                        types.append(int)
+                elif kinds <= set([int, long, float]):
+                        types.append(float)
+                elif kinds == set([str]) and _parses(int, values):
+                        types.append(int)
+                elif kinds == set([str]) and _parses(float, values):
+                        types.append(float)
+                else:
+                        types.append(unicode)
+        return types
+
+def _to_unicode(value):
+        if isinstance(value, str):
+                return value.decode('utf-8')
+        if isinstance(value, (dict, list)):
+                return json.dumps(value)
+        return unicode(value)
+
+def converters(types):
+        """Returns a function converting a raw row to a list of values of
+        types, empty strings are converted to None.
+        """
+        funcs = []
+        for t in types:
+                if t in (int, float, bool):
+                        funcs.append(t)
+                else:
+                        funcs.append(_to_unicode)
+        funcs = list(enumerate(funcs))
+        width = len(funcs)
+        def convert(row):
+                if len(row) < width:
+                        row = list(row) + [None] * (width - len(row))
+                return [None if row[i] is None or row[i] == '' else f(row[i])
+                        for (i, f) in funcs]
+        return convert
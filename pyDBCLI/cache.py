@@ -0,0 +1,232 @@
+#-*- coding: utf-8 -*-
+
+"""Bounded caches for pyDBCLI metadata and query results
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import sys
+import time
+from collections import OrderedDict, namedtuple
+
+# Rows of a cached query result, see result_size() and Utility.run_query()
+CachedResult = namedtuple('CachedResult', 'keys rows version size')
+
+
+class LRUCache(object):
+        """Dict like cache holding at most maxsize entries, evicting the least
+        recently used first. If ttl is set, entries expire ttl seconds after
+        being set. Hits, misses and evictions are counted for stats().
+
+        If weigher is given it's called with each value to find its weight
+        (e.g. its size in bytes), and least recently used entries are also
+        evicted while the total weight is over maxweight. Values heavier
+        than maxweight aren't cached at all.
+        """
+
+        def __init__(self, maxsize=256, ttl=None, maxweight=None, weigher=None):
+                self.maxsize = maxsize
+                self.ttl = ttl
+                self.maxweight = maxweight
+                self.weigher = weigher
+                self.weight = 0
+                self.hits = self.misses = self.evictions = 0
+                self._data = OrderedDict()
+
+        def __getitem__(self, key):
+                try:
+                        entry = self._data.pop(key)
+                except KeyError:
+                        self.misses += 1
+                        raise
+                if entry[0] is not None and entry[0] < time.time():
+                        self.weight -= entry[2]
+                        self.misses += 1
+                        raise KeyError(key)
+                # Re-insert to mark as most recently used
+                self._data[key] = entry
+                self.hits += 1
+                return entry[1]
+
+        def get(self, key, default=None):
+                try:
+                        return self[key]
+                except KeyError:
+                        return default
+
+        def peek(self, key, default=None):
+                """Look up key without affecting stats or recency.
+                """
+                try:
+                        return self._data[key][1]
+                except KeyError:
+                        return default
+
+        def __setitem__(self, key, value):
+                data = self._data
+                if key in data:
+                        del self[key]
+                weight = self.weigher is not None and self.weigher(value) or 0
+                if self.maxweight is not None and weight > self.maxweight:
+                        return
+                data[key] = (self.ttl and time.time() + self.ttl or None, value, weight)
+                self.weight += weight
+                while len(data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+                        self.weight -= data.popitem(last=False)[1][2]
+                        self.evictions += 1
+
+        def __delitem__(self, key):
+                self.weight -= self._data.pop(key)[2]
+
+        def __contains__(self, key):
+                return key in self._data
+
+        def __len__(self):
+                return len(self._data)
+
+        def keys(self):
+                return self._data.keys()
+
+        def clear(self):
+                self._data.clear()
+                self.weight = 0
+
+        def stats(self):
+                """Returns a dict of entries, hits, misses, hit rate,
+                evictions so far and the total weight.
+                """
+                lookups = self.hits + self.misses
+                return {
+                        'entries': len(self._data),
+                        'hits': self.hits,
+                        'misses': self.misses,
+                        'hit_rate': lookups and float(self.hits) / lookups or 0.0,
+                        'evictions': self.evictions,
+                        'weight': self.weight,
+                }
+
+
+class MetadataCache(object):
+        """Dict like cache which keeps a separate LRUCache per namespace,
+        e.g. per connection DSN or schema, so switching back to a namespace
+        reuses its warm cache. Item access applies to the current namespace.
+        At most max_namespaces are kept, least recently used dropped first.
+        """
+
+        def __init__(self, maxsize=256, ttl=None, max_namespaces=16):
+                self.maxsize = maxsize
+                self.ttl = ttl
+                self.namespaces = LRUCache(max_namespaces)
+                self.namespace = None
+                self.current = self._cache(None)
+
+        def _cache(self, namespace):
+                cache = self.namespaces.get(namespace)
+                if cache is None:
+                        cache = self.namespaces[namespace] = LRUCache(self.maxsize, self.ttl)
+                return cache
+
+        def switch(self, namespace):
+                """Make namespace the current namespace.
+                """
+                self.namespace = namespace
+                self.current = self._cache(namespace)
+
+        def __getitem__(self, key):
+                return self.current[key]
+
+        def get(self, key, default=None):
+                return self.current.get(key, default)
+
+        def __setitem__(self, key, value):
+                self.current[key] = value
+
+        def __delitem__(self, key):
+                del self.current[key]
+
+        def __contains__(self, key):
+                return key in self.current
+
+        def __len__(self):
+                return len(self.current)
+
+        def clear(self, namespace=False):
+                """Clear the current namespace, or the given one.
+                """
+                if namespace is False:
+                        self.current.clear()
+                elif namespace in self.namespaces:
+                        self.namespaces.peek(namespace).clear()
+
+        def clear_all(self):
+                for namespace in self.namespaces.keys():
+                        self.namespaces.peek(namespace).clear()
+
+        def stats(self):
+                """Returns a list of (namespace, stats dict) tuples, for
+                each namespace from least to most recently used.
+                """
+                return [(namespace, self.namespaces.peek(namespace).stats())
+                        for namespace in self.namespaces.keys()]
+
+
+class StatementCache(object):
+        """Cursors kept open for re-executing parameterized statements,
+        keyed by connection and SQL, as drivers such as pyodbc skip parsing
+        and planning a statement executed again on the same cursor.
+        At most maxsize are kept, the least recently used closed first.
+        """
+
+        def __init__(self, maxsize=100):
+                self.maxsize = maxsize
+                self.hits = self.misses = self.evictions = 0
+                self._cursors = OrderedDict()
+
+        def cursor(self, connection, sql):
+                """Returns the cached cursor for sql on connection, or a new
+                one from connection.cursor().
+                """
+                key = (id(connection), sql)
+                cursor = self._cursors.pop(key, None)
+                # Connection ids can be reused once it's been closed
+                if cursor is not None and getattr(cursor, 'connection', connection) is connection:
+                        self.hits += 1
+                else:
+                        self.misses += 1
+                        cursor = connection.cursor()
+                self._cursors[key] = cursor
+                while len(self._cursors) > self.maxsize:
+                        self._close(self._cursors.popitem(last=False)[1])
+                        self.evictions += 1
+                return cursor
+
+        def _close(self, cursor):
+                try:
+                        cursor.close()
+                except Exception:
+                        pass
+
+        def __len__(self):
+                return len(self._cursors)
+
+        def clear(self):
+                while self._cursors:
+                        self._close(self._cursors.popitem()[1])
+
+        def stats(self):
+                lookups = self.hits + self.misses
+                return {
+                        'entries': len(self._cursors),
+                        'hits': self.hits,
+                        'misses': self.misses,
+                        'hit_rate': lookups and float(self.hits) / lookups or 0.0,
+                        'evictions': self.evictions,
+                }
+
+
+def result_size(rows):
+        """Rough estimate of the memory used by a list of rows, in bytes.
+        """
+        getsizeof = sys.getsizeof
+        return sum(getsizeof(row) + sum(getsizeof(v) for v in row) for row in rows) + getsizeof(rows)
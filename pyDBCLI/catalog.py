@@ -0,0 +1,74 @@
+#-*- coding: utf-8 -*-
+
+"""Persistent on-disk store for pyDBCLI metadata
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import sqlite3
+import threading
+import time
+import cPickle as pickle
+
+
+class CatalogStore(object):
+        """Persistent store of metadata (e.g. lists of tables and columns),
+        kept in a local SQLite file so it survives between sessions.
+        Entries are keyed by namespace (the backend and DSN/schema) and
+        cache key, and values are pickled.
+        Safe to use from more than one thread.
+        """
+
+        def __init__(self, path):
+                self.path = path
+                self._lock = threading.Lock()
+                self._conn = sqlite3.connect(path, check_same_thread=False)
+                self._conn.text_factory = str
+                with self._lock:
+                        self._conn.execute("""CREATE TABLE IF NOT EXISTS catalog (
+                                namespace TEXT NOT NULL,
+                                key TEXT NOT NULL,
+                                value BLOB NOT NULL,
+                                updated REAL NOT NULL,
+                                PRIMARY KEY (namespace, key))""")
+                        self._conn.commit()
+
+        def get(self, namespace, key):
+                """Returns a tuple of the value stored for key and the time
+                it was stored, or None if there isn't one.
+                """
+                with self._lock:
+                        row = self._conn.execute(
+                                "SELECT value, updated FROM catalog WHERE namespace=? AND key=?",
+                                (namespace, repr(key))).fetchone()
+                if row is None:
+                        return None
+                try:
+                        return pickle.loads(str(row[0])), row[1]
+                except Exception:
+                        # Unreadable, e.g. written by an incompatible version
+                        return None
+
+        def set(self, namespace, key, value):
+                data = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+                with self._lock:
+                        self._conn.execute(
+                                "INSERT OR REPLACE INTO catalog (namespace, key, value, updated) VALUES (?, ?, ?, ?)",
+                                (namespace, repr(key), data, time.time()))
+                        self._conn.commit()
+
+        def clear(self, namespace=None):
+                """Remove everything stored for namespace, or for every
+                namespace if None.
+                """
+                with self._lock:
+                        if namespace is None:
+                                self._conn.execute("DELETE FROM catalog")
+                        else:
+                                self._conn.execute("DELETE FROM catalog WHERE namespace=?", (namespace,))
+                        self._conn.commit()
+
+        def close(self):
+                with self._lock:
+                        self._conn.close()
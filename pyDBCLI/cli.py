@@ -0,0 +1,42 @@
+#-*- coding: utf-8 -*-
+
+"""pydbcli command, running the CLI of a backend from
+pyDBCLI.registry.backends, e.g. pydbcli sqlite -f my.db
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import sys
+from pyDBCLI import registry
+from pyDBCLI.helpers import error, usage
+
+# Shell script usage instrunctions, pushed to stdout
+# by usage()
+USAGE_MESSAGE = """pyDBCLI database CLI
+Usage: pydbcli <backend> [<options>]
+
+Backends:
+%s
+
+Run pydbcli <backend> for the backend's own options.
+"""
+
+
+def main(argv=None):
+        """Main entry function for CLI script, should be
+        passed CLI args tuple, normally from sys.argv
+        """
+        if argv is None:
+                argv = sys.argv[1:]
+        message = USAGE_MESSAGE % ('\n'.join('    %s' % (name,) for name in registry.backends.names()),)
+        if not argv or argv[0] in ('-h', '--help'):
+                usage(message)
+                sys.exit(0)
+        if argv[0] not in registry.backends:
+                error("Unknown backend %s" % (argv[0],), True, message)
+        # Only the chosen backend (and its driver) is imported
+        registry.backends.get(argv[0])(argv[1:])
+
+if __name__ == "__main__":
+        main()
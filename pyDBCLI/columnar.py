@@ -0,0 +1,262 @@
+#-*- coding: utf-8 -*-
+
+"""Compact column oriented store of a query result, so the last result
+can be sorted, filtered and re-rendered without re-running the query,
+see \\sort, \\filter and \\top
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import re
+import operator
+from array import array
+
+# Comparison operators accepted by ColumnStore.filter()
+OPERATORS = {
+        '=': operator.eq,
+        '==': operator.eq,
+        '!=': operator.ne,
+        '<>': operator.ne,
+        '<': operator.lt,
+        '<=': operator.le,
+        '>': operator.gt,
+        '>=': operator.ge,
+}
+# Types interned with a single map() call in Column.extend()
+_interned_types = frozenset([str, unicode, type(None)])
+
+
+class Column(object):
+        """Values of a single column. Integers and floats are kept in an
+        array ('l' or 'd'), anything else in a list, with strings interned
+        through the strings dict shared by a ColumnStore so repeated values
+        are only held once. NULLs are kept as a set of row indexes.
+        """
+
+        def __init__(self, strings):
+                self.values = None
+                self.nulls = set()
+                self.size = 0
+                # Whether strings are interned, turned off for columns of
+                # mostly distinct values
+                self.intern = True
+                self._strings = strings
+
+        def __len__(self):
+                return self.size
+
+        def __getitem__(self, i):
+                if i in self.nulls:
+                        return None
+                return self.values[i]
+
+        def extend(self, values):
+                """Append a sequence of values, promoting the column to a
+                more general type if a value doesn't fit.
+                """
+                start = self.size
+                # Not "None in values", which is slow for unicode values
+                nulls = [i for (i, v) in enumerate(values) if v is None]
+                if nulls:
+                        self.nulls.update(start + i for i in nulls)
+                if self.values is None:
+                        typecode = self._typecode(values, start)
+                        if typecode is False:
+                                # Nothing but NULLs so far, type not known yet
+                                self.size += len(values)
+                                return
+                        if typecode:
+                                self.values = array(typecode, [0]) * start
+                        else:
+                                self.values = [None] * start
+                if isinstance(self.values, array):
+                        numbers = values
+                        if nulls:
+                                # Arrays can't hold None, NULLs are in self.nulls
+                                numbers = list(values)
+                                for i in nulls:
+                                        numbers[i] = 0
+                        try:
+                                self.values.extend(numbers)
+                        except (TypeError, OverflowError):
+                                del self.values[start:]
+                                self._promote(values)
+                                if isinstance(self.values, array):
+                                        self.values.extend(numbers)
+                                        self.size += len(values)
+                                        return
+                        else:
+                                self.size += len(values)
+                                return
+                if not self.intern:
+                        self.values.extend(values)
+                else:
+                        strings = self._strings
+                        before = len(strings)
+                        setdefault = strings.setdefault
+                        if set(map(type, values)) <= _interned_types:
+                                self.values.extend(map(setdefault, values, values))
+                        else:
+                                self.values.extend([isinstance(v, basestring) and setdefault(v, v) or v
+                                                    for v in values])
+                        # Stop interning (mostly) unique values, e.g. names
+                        if len(values) >= 100 and len(strings) - before > len(values) // 2:
+                                self.intern = False
+                self.size += len(values)
+
+        def _typecode(self, values, start):
+                """Returns the array typecode for the first non-NULL value,
+                None if it isn't a number, or False if they're all NULL.
+                """
+                for i, v in enumerate(values):
+                        if start + i not in self.nulls:
+                                if type(v) in (int, long):
+                                        return 'l'
+                                if type(v) is float:
+                                        return 'd'
+                                return None
+                return False
+
+        def _promote(self, values):
+                """Swap the array for one that can hold values, an array of
+                doubles if they're all numbers, otherwise a list.
+                """
+                values = [v for v in values if v is not None]
+                if self.values.typecode == 'l' and all(type(v) in (int, long, float) for v in values):
+                        # Large integers could lose precision as doubles
+                        if all(type(v) is float or -2 ** 53 <= v <= 2 ** 53 for v in values):
+                                self.values = array('d', self.values)
+                                return
+                self.values = [v for v in self.values]
+                for i in self.nulls:
+                        self.values[i] = None
+
+
+class ColumnStore(object):
+        """Rows of a result, held column by column, plus a view (the list of
+        row indexes to show, in order) which sort(), filter() and
+        reset() change. At most max_rows are kept, if more are added the
+        store is marked truncated.
+        """
+
+        def __init__(self, keys, max_rows=None):
+                self.keys = list(keys)
+                self.max_rows = max_rows
+                self.truncated = False
+                self._strings = {}
+                self.columns = [Column(self._strings) for k in self.keys]
+                self.count = 0
+                self.view = None
+
+        def __len__(self):
+                return self.count
+
+        def extend(self, batch):
+                """Add a batch of rows, returning False once the store is full.
+                """
+                if self.max_rows is not None:
+                        room = self.max_rows - self.count
+                        if len(batch) > room:
+                                batch = batch[:room]
+                                self.truncated = True
+                if batch:
+                        for column, values in zip(self.columns, zip(*batch)):
+                                column.extend(values)
+                        self.count += len(batch)
+                return not self.truncated
+
+        def collect(self, batches):
+                """Generator passing row batches through, adding them to the
+                store until it's full.
+                """
+                full = False
+                for batch in batches:
+                        if not full:
+                                full = not self.extend(batch)
+                        yield batch
+
+        def column(self, name):
+                """Returns the index of the column called name (case
+                insensitive), or at 1 based position name.
+                """
+                if name.isdigit() and 0 < int(name) <= len(self.keys):
+                        return int(name) - 1
+                lowered = [k.lower() for k in self.keys]
+                name = name.strip('"`[]').lower()
+                if name in lowered:
+                        return lowered.index(name)
+                raise KeyError(name)
+
+        def indexes(self):
+                if self.view is None:
+                        return range(self.count)
+                return self.view
+
+        def reset(self):
+                self.view = None
+
+        def sort(self, name, descending=False):
+                """Order the view by the column name, NULLs first (last if
+                descending). Sorts are stable, so sorting by one column then
+                another orders by the second then the first.
+                """
+                column = self.columns[self.column(name)]
+                values, nulls = column.values, column.nulls
+                if values is None:
+                        # Nothing but NULLs
+                        return
+                if nulls:
+                        key = lambda i: i in nulls and (0, None) or (1, values[i])
+                else:
+                        key = values.__getitem__
+                self.view = sorted(self.indexes(), key=key, reverse=descending)
+
+        def filter(self, name, op, value):
+                """Narrow the view to rows where the column name compares to
+                value with op, one of OPERATORS, 'like' (SQL LIKE pattern,
+                case insensitive), '~' (regular expression), or 'is' / 'is
+                not' with a value of None.
+                """
+                column = self.columns[self.column(name)]
+                values, nulls = column.values, column.nulls
+                op = op.lower()
+                if op in ('is', 'is not'):
+                        if value is not None:
+                                raise ValueError("Only NULL can be compared with %s" % (op.upper(),))
+                        want = op == 'is'
+                        self.view = [i for i in self.indexes() if (i in nulls) == want]
+                        return
+                if op in ('like', '~'):
+                        if op == 'like':
+                                pattern = ''.join(c == '%' and '.*' or c == '_' and '.' or re.escape(c)
+                                                  for c in unicode(value))
+                                match = re.compile('^%s$' % (pattern,), re.I | re.S | re.U).match
+                        else:
+                                match = re.compile(unicode(value), re.U).search
+                        test = lambda v: match(isinstance(v, basestring) and v or unicode(v)) is not None
+                elif op in OPERATORS:
+                        compare = OPERATORS[op]
+                        test = lambda v: compare(v, value)
+                else:
+                        raise ValueError("Unknown operator %s" % (op,))
+                if values is None:
+                        self.view = []
+                else:
+                        self.view = [i for i in self.indexes() if i not in nulls and test(values[i])]
+
+        def rows(self, limit=None, batch_size=1000):
+                """Generator yielding batches of the rows in the view, up to
+                limit rows.
+                """
+                indexes = self.indexes()
+                if limit is not None:
+                        indexes = indexes[:limit]
+                columns = self.columns
+                for start in xrange(0, len(indexes), batch_size):
+                        yield [tuple(c[i] for c in columns) for i in indexes[start:start + batch_size]]
+
+        def __iter__(self):
+                for batch in self.rows():
+                        for row in batch:
+                                yield row
@@ -0,0 +1,111 @@
+#-*- coding: utf-8 -*-
+
+"""Tab completion of SQL keywords, tables and columns for pyDBCLI
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import re
+from bisect import bisect_left
+
+KEYWORDS = [
+        'ALTER', 'AND', 'AS', 'ASC', 'BEGIN', 'BETWEEN', 'BY', 'CASE', 'COMMIT',
+        'COUNT', 'CREATE', 'CROSS', 'DEFAULT', 'DELETE', 'DESC', 'DISTINCT',
+        'DROP', 'ELSE', 'END', 'EXISTS', 'EXPLAIN', 'FROM', 'FULL', 'GROUP',
+        'HAVING', 'IN', 'INDEX', 'INNER', 'INSERT', 'INTO', 'IS', 'JOIN', 'LEFT',
+        'LIKE', 'LIMIT', 'NOT', 'NULL', 'OFFSET', 'ON', 'OR', 'ORDER', 'OUTER',
+        'PRIMARY', 'KEY', 'RIGHT', 'ROLLBACK', 'SELECT', 'SET', 'TABLE', 'THEN',
+        'UNION', 'UPDATE', 'USING', 'VALUES', 'VIEW', 'WHEN', 'WHERE', 'WITH',
+]
+
+# Keywords after which only a table name makes sense
+TABLE_KEYWORDS = frozenset(['FROM', 'JOIN', 'INTO', 'UPDATE', 'TABLE'])
+
+_previous_word_re = re.compile(r'([A-Za-z_]+)[\s,]*$')
+_alias_re = re.compile(r'(?:FROM|JOIN|UPDATE|INTO|,)\s+([\w$]+)(?:\s+(?:AS\s+)?(\w+))?', re.I)
+
+
+class PrefixIndex(object):
+        """Sorted array of words, searched with bisect for case insensitive
+        prefix matches in O(log n) plus the nr. of matches.
+        """
+
+        def __init__(self, words=()):
+                pairs = sorted(set((w.lower(), w) for w in words))
+                self._keys = [k for (k, w) in pairs]
+                self._words = [w for (k, w) in pairs]
+
+        def __len__(self):
+                return len(self._keys)
+
+        def complete(self, prefix, limit=None):
+                """Returns the words starting with prefix, at most limit of
+                them if given.
+                """
+                prefix = prefix.lower()
+                keys = self._keys
+                i = bisect_left(keys, prefix)
+                end = len(keys)
+                if limit is not None:
+                        end = min(end, i + limit)
+                matches = []
+                while i < end and keys[i].startswith(prefix):
+                        matches.append(self._words[i])
+                        i += 1
+                return matches
+
+
+class Completer(object):
+        """Context aware completion of SQL keywords, table names and column
+        names, from prefix indexes built from a pyDBCLI.schema.SchemaModel.
+        Indexes are swapped in whole by load(), so it can be called from
+        a background thread while completions are being served.
+        """
+        # Max. nr. of completions offered
+        limit = 500
+
+        def __init__(self):
+                self.keywords = PrefixIndex(KEYWORDS)
+                self.tables = PrefixIndex()
+                self.columns = PrefixIndex()
+                self.model = None
+
+        def load(self, model):
+                tables = PrefixIndex(model.table_names())
+                columns = PrefixIndex(model.column_names())
+                self.tables, self.columns, self.model = tables, columns, model
+
+        def complete(self, text, line, begidx):
+                """Returns the completions for text, which starts at begidx
+                in line.
+                """
+                if '.' in text:
+                        return self.complete_qualified(text, line)
+
+                m = _previous_word_re.search(line[:begidx])
+                previous = m and m.group(1).upper() or ''
+                if previous in TABLE_KEYWORDS:
+                        return self.tables.complete(text, self.limit)
+
+                keywords = self.keywords.complete(text, self.limit)
+                if text and text[0].islower():
+                        keywords = [k.lower() for k in keywords]
+                matches = keywords + self.columns.complete(text, self.limit)
+                matches.extend(self.tables.complete(text, self.limit))
+                seen = set()
+                return [w for w in matches if not (w in seen or seen.add(w))][:self.limit]
+
+        def complete_qualified(self, text, line):
+                """Complete table.column, where table may be an alias given
+                in the FROM/JOIN clauses of line.
+                """
+                model = self.model
+                if model is None:
+                        return []
+                table, prefix = text.rsplit('.', 1)
+                aliases = dict((alias.lower(), name) for (name, alias) in _alias_re.findall(line) if alias)
+                table = aliases.get(table.lower(), table)
+                prefix = prefix.lower()
+                return ['%s.%s' % (text.rsplit('.', 1)[0], c.name) for c in model.columns(table)
+                        if c.name.lower().startswith(prefix)]
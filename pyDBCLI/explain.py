@@ -0,0 +1,167 @@
+#-*- coding: utf-8 -*-
+
+"""Query plans for pyDBCLI, rendering them as a tree, flagging costly
+steps and suggesting indexes, see \\explain and \\analyze
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import re
+from collections import namedtuple
+
+# A step of a query plan, parent is the id of the step it's part of (0
+# for the top level)
+PlanNode = namedtuple('PlanNode', ('id', 'parent', 'detail'))
+
+# Flags for costly plan steps, and patterns matching them in the plans
+# of SQLite, PostgreSQL, MySQL and SQL Server
+FLAGS = (
+        ('full scan', re.compile(r'^(?:\s*SCAN\b(?!.*\bUSING\b.*\bINDEX\b))|\bSeq Scan\b|\bTable Scan\b'
+                                 r'|\bFULL TABLE\b|\btype=ALL\b', re.I)),
+        ('temp b-tree', re.compile(r'\bTEMP B-TREE\b|\bUsing temporary\b|\bUsing filesort\b', re.I)),
+        ('automatic index', re.compile(r'\bAUTOMATIC\b.*\bINDEX\b', re.I)),
+)
+# Table names in full scan steps, e.g. SCAN t, SCAN TABLE t AS a, Seq
+# Scan on t or (MySQL, see Utility.get_plan()) table=t ... type=ALL
+_scan_table_res = (
+        re.compile(r'(?:^\s*SCAN(?:\s+TABLE)?|\bSeq Scan on)\s+["`\[]?([\w$]+)', re.I),
+        re.compile(r'\btable=([\w$]+)(?=.*\btype=ALL\b)', re.I),
+)
+_automatic_re = re.compile(r'^\s*SEARCH(?:\s+TABLE)?\s+["`\[]?([\w$]+)', re.I)
+_alias_re = re.compile(r'\b(?:FROM|JOIN)\s+("[^"]+"|`[^`]+`|\[[^\]]+\]|[\w$.]+)'
+                       r'(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|USING|LEFT|RIGHT|INNER|OUTER|CROSS|NATURAL'
+                       r'|GROUP|ORDER|LIMIT|HAVING|UNION|WINDOW)\b)([\w$]+))?', re.I)
+_predicate_re = re.compile(r'(?:([\w$]+)\.)?([\w$]+)\s*(=|==|<=|>=|<>|!=|<|>|\bIN\b|\bLIKE\b|\bBETWEEN\b|\bIS\b)', re.I)
+_order_re = re.compile(r'\bORDER\s+BY\s+(.+?)(?:\bLIMIT\b|$)', re.I | re.S)
+_where_re = re.compile(r'\b(?:WHERE|ON)\b(.+?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|\bJOIN\b|$)', re.I | re.S)
+_range_ops = frozenset(['<', '>', '<=', '>=', 'BETWEEN', 'LIKE', '<>', '!='])
+
+
+def flags(detail):
+        """Returns the list of FLAGS matching a plan step's detail.
+        """
+        return [name for (name, pattern) in FLAGS if pattern.search(detail)]
+
+
+def indented_plan(lines, marker_re=re.compile(r'^(\s*)(?:->\s*|\|--\s*)?')):
+        """Build PlanNodes from lines of a textual plan, where nesting is
+        shown by indentation (e.g. PostgreSQL's "->" or SQL Server's
+        "|--" steps).
+        """
+        nodes = []
+        stack = []
+        for i, line in enumerate(lines):
+                if not line.strip():
+                        continue
+                m = marker_re.match(line)
+                depth = len(m.group(1))
+                while stack and stack[-1][0] >= depth:
+                        stack.pop()
+                parent = stack and stack[-1][1] or 0
+                nodes.append(PlanNode(i + 1, parent, line[m.end():].rstrip()))
+                stack.append((depth, i + 1))
+        return nodes
+
+
+def plan_rows(nodes):
+        """Returns a table of plan steps, indented as a tree with their
+        flags, header first.
+        """
+        children = {}
+        ids = set(node.id for node in nodes)
+        for node in nodes:
+                parent = node.parent in ids and node.parent or 0
+                children.setdefault(parent, []).append(node)
+        rows = [['Plan', 'Flags']]
+
+        def walk(parent, depth):
+                for node in children.get(parent, ()):
+                        prefix = depth and '   ' * (depth - 1) + '`--' or ''
+                        rows.append(['%s%s' % (prefix, node.detail), ', '.join(flags(node.detail))])
+                        if node.id != parent:
+                                walk(node.id, depth + 1)
+        walk(0, 0)
+        return rows
+
+
+def scanned_tables(nodes):
+        """Returns the names of tables read with a full scan (or an index
+        built on the fly) in a plan, in order.
+        """
+        tables = []
+        for node in nodes:
+                step = flags(node.detail)
+                m = None
+                if 'full scan' in step:
+                        for pattern in _scan_table_res:
+                                m = pattern.search(node.detail)
+                                if m:
+                                        break
+                elif 'automatic index' in step:
+                        m = _automatic_re.search(node.detail)
+                if m and m.group(1) not in tables:
+                        tables.append(m.group(1))
+        return tables
+
+
+def _unquote(name):
+        return name.strip('"`[]')
+
+
+def suggest_indexes(sql, tables, columns):
+        """Suggest indexes for tables (names or aliases, as they appear
+        in a plan) from the columns sql filters, joins or sorts them on.
+        columns(table) should return the table's column names (empty if
+        there's no such table). Returns a list of (table, [column, ...])
+        with columns compared for equality first, then at most one range
+        (or ORDER BY) column.
+        """
+        aliases = {}
+        for table, alias in _alias_re.findall(sql):
+                table = _unquote(table).split('.')[-1]
+                aliases[table.lower()] = table
+                if alias:
+                        aliases[alias.lower()] = table
+        predicates = []
+        for clause in _where_re.findall(sql):
+                predicates.extend(_predicate_re.findall(clause))
+        order = _order_re.search(sql)
+        order_columns = []
+        if order:
+                for term in order.group(1).split(','):
+                        parts = term.strip().split()
+                        if parts:
+                                qualifier, sep, name = parts[0].rpartition('.')
+                                order_columns.append((qualifier, name))
+
+        suggestions = []
+        for name in tables:
+                table = aliases.get(name.lower(), name)
+                known = dict((c.lower(), c) for c in columns(table))
+                if not known:
+                        continue
+                names = [a for (a, t) in aliases.items() if t == table] + [name.lower(), table.lower()]
+
+                def column(qualifier, col):
+                        if qualifier and qualifier.lower() not in names:
+                                return None
+                        return known.get(_unquote(col).lower())
+                equal, ranges = [], []
+                for qualifier, col, op in predicates:
+                        col = column(qualifier, col)
+                        if col is None:
+                                continue
+                        if op.upper() in _range_ops:
+                                if col not in ranges:
+                                        ranges.append(col)
+                        elif col not in equal:
+                                equal.append(col)
+                ranges = [c for c in ranges if c not in equal]
+                for qualifier, col in order_columns:
+                        col = column(qualifier, col)
+                        if col is not None and col not in equal and not ranges:
+                                ranges.append(col)
+                if equal or ranges:
+                        suggestions.append((table, equal + ranges[:1]))
+        return suggestions
@@ -7,51 +7,340 @@ __author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
 __docformat__ = 'restructuredtext en'
 __version__ = '0.1'
 
+import re
 import sqlite3
 import getopt
 import sys
+import time
+from collections import OrderedDict
 from pyDBCLI.utils import Utility
-from pyDBCLI.helpers import error, usage, memoized
+from pyDBCLI.helpers import error, usage, print_table
+from pyDBCLI.schema import SchemaModel, Column
+from pyDBCLI.catalog import CatalogStore
+
+# Performance profiles, PRAGMAs run in order on every new connection
+PROFILES = OrderedDict([
+        # SQLite's own defaults
+        ('default', ()),
+        # Large scans of big files: reads through a memory map rather than
+        # read() calls, a 256MB page cache and temp. b-trees in memory
+        ('read', (
+                ('mmap_size', 1073741824),
+                ('cache_size', -262144),
+                ('temp_store', 'MEMORY'),
+        )),
+        # Bulk loads and concurrent readers: write-ahead log, only synced
+        # at checkpoints
+        ('write', (
+                ('journal_mode', 'WAL'),
+                ('synchronous', 'NORMAL'),
+                ('cache_size', -65536),
+                ('temp_store', 'MEMORY'),
+                ('mmap_size', 268435456),
+        )),
+])
+# PRAGMAs that change the database file, rather than the connection,
+# so are left out of \pragma bench
+PERSISTENT_PRAGMAS = frozenset(['journal_mode', 'page_size', 'auto_vacuum'])
+
+_pragma_re = re.compile(r'^\s*([A-Za-z_]+)\s*(?:=\s*([\w.+-]+)\s*)?$')
+
 
 class LiteUtility(Utility):
         prompt = 'litecli# '
         intro = 'My Custom SQLite interactive CLI'
+        special_cmds = Utility.special_cmds + ['pragma']
+        # executemany() has little per-call overhead in sqlite3, so larger
+        # \import chunks mean fewer commits (and fsyncs)
+        import_chunk_size = 50000
+        # Name of the PROFILES entry applied to every connection
+        profile = 'default'
+        # If True connections can't write, with PRAGMA query_only
+        readonly = False
+        # Nr. of times each query of \pragma bench is timed, the fastest
+        # counts
+        bench_repeat = 3
+
+        def __init__(self, *args, **kwargs):
+                Utility.__init__(self, *args, **kwargs)
+                # PRAGMAs set with \pragma <name>=<value>, applied after
+                # the profile's
+                self.pragmas = OrderedDict()
+                # Defaults of the connection level PRAGMAs profiles set,
+                # read from the first connection opened
+                self._pragma_defaults = None
+                # connection_pragmas() last applied to each pooled
+                # connection, by DSN
+                self._applied_pragmas = {}
 
-        @memoized()
-        def get_tables(self):
-                r = self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = [['Table name',],]
-                for row in r:
-                        tables.append([row[0]])
-                return tables
-
-        @memoized()
-        def get_columns(self, name):
-                r = self.cursor.execute("""SELECT sql FROM sqlite_master WHERE
-                                        type='table' AND name='%s'""" % (name,))
-                columns = [['SQL',],]
-                for row in r:
-                        columns.append([row[0]])
-                return columns
-
-        def connect(self, filepath):
+        def load_schema(self):
                 try:
-                        conn = sqlite3.connect(filepath)
-                        self.system_cursor = self.cursor = conn.cursor()
-                except:
-                        error(e, False)
+                        r = self.cursor.execute("""SELECT m.name, p.name, p.type, p."notnull", p.pk, p.cid
+                                                FROM sqlite_master m JOIN pragma_table_xinfo(m.name) p
+                                                WHERE m.type IN ('table', 'view')""")
+                        rows = r.fetchall()
+                except sqlite3.OperationalError:
+                        # SQLite < 3.26, no table valued pragma_table_xinfo
+                        rows = []
+                        r = self.cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
+                        for (table,) in r.fetchall():
+                                for row in self.cursor.execute('PRAGMA table_info(%s)' % (self.quote_ident(table),)):
+                                        rows.append((table, row[1], row[2], row[3], row[5], row[0]))
+                return SchemaModel(columns=[
+                        Column(table, name, type, None, not notnull, bool(pk), cid)
+                        for (table, name, type, notnull, pk, cid) in rows
+                ])
+
+        def table_exists(self, table):
+                r = self.cursor.execute("""SELECT 1 FROM sqlite_master WHERE
+                                        type IN ('table', 'view') AND name=?""", (table,))
+                return r.fetchone() is not None
+
+        def open_connection(self, filepath, profile=None):
+                # Connections are used from worker threads, see
+                # Utility.iter_query() and Utility.new_cursor()
+                conn = sqlite3.connect(filepath, check_same_thread=False,
+                                       cached_statements=self.statement_cache_size)
+                if self._pragma_defaults is None:
+                        self._pragma_defaults = [(name, self.get_pragma(name, conn))
+                                                 for name in self.connection_pragma_names()]
+                self.apply_pragmas(conn, self.profile_pragmas(profile))
+                return conn
+
+        def connect(self, dsn):
+                if not Utility.connect(self, dsn):
                         return False
+                # A pooled connection may have been opened with another
+                # profile, or before a \pragma
+                pragmas = self.connection_pragmas()
+                if self._applied_pragmas.get(dsn) != pragmas:
+                        self.apply_pragmas(self.cursor.connection, pragmas)
+                        self._applied_pragmas[dsn] = pragmas
+                return True
+
+        def profile_pragmas(self, profile=None):
+                """Returns the (name, value) PRAGMAs for profile (by default
+                the current one), plus any set with \\pragma and query_only
+                if readonly.
+                """
+                pragmas = OrderedDict(PROFILES[profile or self.profile])
+                pragmas.update(self.pragmas)
+                if self.readonly:
+                        pragmas['query_only'] = 1
+                return pragmas.items()
+
+        def connection_pragma_names(self):
+                """Returns the names of every PRAGMA set by a profile (or
+                readonly) which only lasts for the connection.
+                """
+                names = ['query_only']
+                for pragmas in PROFILES.values():
+                        for name, value in pragmas:
+                                if name not in PERSISTENT_PRAGMAS and name not in names:
+                                        names.append(name)
+                return names
+
+        def connection_pragmas(self):
+                """Returns profile_pragmas(), preceded by the defaults of
+                connection level PRAGMAs it doesn't set, to undo another
+                profile's. PRAGMAs that change the file (e.g. journal_mode)
+                are left as they are.
+                """
+                pragmas = self.profile_pragmas()
+                names = set(name for (name, value) in pragmas)
+                defaults = [(name, value) for (name, value) in self._pragma_defaults or ()
+                            if name not in names and value is not None]
+                return defaults + pragmas
+
+        def apply_pragmas(self, conn, pragmas):
+                for name, value in pragmas:
+                        try:
+                                conn.execute('PRAGMA %s = %s' % (name, value)).fetchall()
+                        except sqlite3.Error, e:
+                                error("PRAGMA %s = %s failed: %s" % (name, value, e), False)
+
+        def get_plan(self, sql, params=None):
+                from pyDBCLI.explain import PlanNode
+                r = self.cursor.connection.execute('EXPLAIN QUERY PLAN %s' % (sql,), params or ())
+                return [PlanNode(row[0], row[1], row[3]) for row in r.fetchall()]
+
+        def plan_stats(self, sql, params=None):
+                # Nr. of virtual machine instructions the query compiles to
+                r = self.cursor.connection.execute('EXPLAIN %s' % (sql,), params or ())
+                return [('VM opcodes', len(r.fetchall()))]
+
+        def test_index(self, sql, params, create):
+                # Built in a transaction on a connection of its own, and
+                # rolled back, so the file's left as it was
+                conn = sqlite3.connect(self.current_dsn, isolation_level=None, check_same_thread=False)
+                try:
+                        self.apply_pragmas(conn, [(name, value) for (name, value) in self.profile_pragmas()
+                                                  if name not in PERSISTENT_PRAGMAS])
+                        before = self.time_query(conn, sql, params)
+                        conn.execute('BEGIN')
+                        try:
+                                conn.execute(create)
+                                after = self.time_query(conn, sql, params)
+                        finally:
+                                conn.execute('ROLLBACK')
+                finally:
+                        conn.close()
+                return before, after
+
+        def time_query(self, conn, sql, params=None):
+                """Returns the fastest of bench_repeat runs of sql on conn,
+                fetching (and discarding) every row, in seconds.
+                """
+                best = None
+                for i in range(self.bench_repeat):
+                        started = time.time()
+                        cursor = conn.execute(sql, params or ())
+                        while cursor.fetchmany(self.fetch_size):
+                                pass
+                        elapsed = time.time() - started
+                        if best is None or elapsed < best:
+                                best = elapsed
+                return best
+
+        def do_pragma(self, line):
+                """\\pragma [<name>[=<value>]|profile [<name>]|bench [<profile> ...]]
+Show the PRAGMAs set by the current performance profile (and their
+values), show or set a PRAGMA for this and every new connection, switch
+profile (with no name, lists them), or time a standard set of queries on
+this database with each profile (by default all of them).
+"""
+                if self.splitter.pending:
+                        return
+                args = line.split()
+                if not args:
+                        print >> sys.stdout, "Profile: %s%s" % (self.profile, self.readonly and ' (read-only)' or '',)
+                        rows = [['Pragma', 'Value']]
+                        for name, value in self.profile_pragmas():
+                                rows.append([name, self.get_pragma(name)])
+                        if len(rows) > 1:
+                                print_table(rows, self.vertical_display)
+                elif args[0] == 'profile':
+                        if len(args) == 1:
+                                rows = [['Profile', 'Pragmas']]
+                                for name, pragmas in PROFILES.items():
+                                        rows.append(['%s%s' % (name, name == self.profile and ' *' or ''),
+                                                     ', '.join('%s=%s' % p for p in pragmas)])
+                                print_table(rows, self.vertical_display)
+                        elif args[1] not in PROFILES:
+                                error("Unknown profile %s, expected one of: %s" % (
+                                        args[1], ', '.join(PROFILES),), False)
+                        else:
+                                self.profile = args[1]
+                                pragmas = self.connection_pragmas()
+                                self.apply_pragmas(self.cursor.connection, pragmas)
+                                self._applied_pragmas[self.current_dsn] = pragmas
+                                print >> sys.stdout, "Profile %s applied." % (self.profile,)
+                elif args[0] == 'bench':
+                        unknown = [p for p in args[1:] if p not in PROFILES]
+                        if unknown:
+                                error("Unknown profile %s" % (', '.join(unknown),), False)
+                                return
+                        try:
+                                self.bench_profiles(args[1:] or PROFILES.keys())
+                        except KeyboardInterrupt:
+                                print >> sys.stdout, "\nCancelled."
                 else:
-                        return True
+                        m = _pragma_re.match(line)
+                        if not m:
+                                error("Usage: \\pragma [<name>[=<value>]|profile [<name>]|bench [<profile> ...]]", False)
+                        elif m.group(2) is None:
+                                print_table([['Pragma', 'Value'], [m.group(1), self.get_pragma(m.group(1))]],
+                                            self.vertical_display)
+                        else:
+                                self.pragmas[m.group(1).lower()] = m.group(2)
+                                self.apply_pragmas(self.cursor.connection, [(m.group(1), m.group(2))])
+                                self._applied_pragmas[self.current_dsn] = self.connection_pragmas()
+                                print >> sys.stdout, "%s = %s" % (m.group(1), self.get_pragma(m.group(1)),)
+
+        def get_pragma(self, name, conn=None):
+                try:
+                        row = (conn or self.cursor.connection).execute('PRAGMA %s' % (name,)).fetchone()
+                except sqlite3.Error, e:
+                        return str(e)
+                return row and row[0]
+
+        def bench_queries(self):
+                """Returns the standard queries timed by \\pragma bench, a
+                count, full scan, sort and group by for each table.
+                """
+                queries = []
+                model = self.get_schema_model()
+                for table in model.table_names():
+                        columns = model.columns(table)
+                        if not columns:
+                                continue
+                        t, c = self.quote_ident(table), self.quote_ident(columns[0].name)
+                        queries.extend([
+                                'SELECT count(*) FROM %s' % (t,),
+                                'SELECT * FROM %s' % (t,),
+                                'SELECT * FROM %s ORDER BY %s DESC LIMIT 100' % (t, c),
+                                'SELECT %s, count(*) FROM %s GROUP BY 1' % (c, t),
+                        ])
+                return queries
+
+        def bench_profiles(self, profiles):
+                """Time bench_queries() with each of profiles, on a new
+                connection per profile, printing a table of the fastest of
+                bench_repeat runs of each query.
+                Only the profile's own PRAGMAs are applied, less those that
+                change the file (e.g. journal_mode).
+                """
+                queries = self.bench_queries()
+                if not queries:
+                        print >> sys.stdout, "No tables to query."
+                        return
+                times = []
+                for profile in profiles:
+                        conn = sqlite3.connect(self.current_dsn, check_same_thread=False)
+                        try:
+                                self.apply_pragmas(conn, [(name, value) for (name, value) in PROFILES[profile]
+                                                          if name not in PERSISTENT_PRAGMAS])
+                                times.append([self.time_query(conn, sql) for sql in queries])
+                        finally:
+                                conn.close()
+                rows = [['Query'] + list(profiles)]
+                for i, sql in enumerate(queries):
+                        rows.append([sql] + ['%.3f ms' % (t[i] * 1000,) for t in times])
+                rows.append(['Total'] + ['%.3f ms' % (sum(t) * 1000,) for t in times])
+                print_table(rows, self.vertical_display)
+
+        def cancel_query(self, cursor):
+                cursor.connection.interrupt()
+
+        def data_version(self):
+                # Changes when another connection commits, this session's
+                # own writes invalidate the result cache directly
+                return self.cursor.connection.execute('PRAGMA data_version').fetchone()[0]
 
 
 # Shell script usage instrunctions, pushed to stdout
 # by usage()
 USAGE_MESSAGE = """My SQLite CLI replacement
-Usage: litecli.py -f <file>
+Usage: litecli.py -f <file> [-e <sql>] [-i <file>]
 
 Options:
-    -f, --file : SQLite DB file path
+    -f, --file : SQLite DB file path, or a glob (e.g. 'shards/*.db') to run
+                 every statement on all matching files in parallel
+    -e, --execute : SQL to run instead of starting the interactive prompt
+    -i, --input : File of SQL to run ('-' for STDIN) instead of starting the
+                  interactive prompt
+    -t, --transaction-size : Nr. of statements per transaction when running
+                             -e/-i, 0 for a single transaction (default 1)
+    -k, --continue : Carry on after a failed statement when running -e/-i
+    --stop-on-error : Roll back and stop at the first failed statement when
+                      running -e/-i (default)
+    -C, --catalog : File to keep a persistent cache of tables and columns in,
+                    shared between sessions
+    -P, --profile : Performance profile to apply to every connection, one of
+                    default, read (mmap, large page cache) or write (WAL)
+    --readonly : Open the DB read-only (PRAGMA query_only)
+    --pragma : PRAGMA to apply to every connection, as <name>=<value>, can
+               be given more than once
 """
 
 def main(argv):
@@ -62,9 +351,18 @@ def main(argv):
         try:
                 opts, args = getopt.getopt(
                         argv,
-                        "f:",
+                        "f:e:i:t:kC:P:",
                         [
                                 "file=",
+                                "execute=",
+                                "input=",
+                                "transaction-size=",
+                                "continue",
+                                "stop-on-error",
+                                "catalog=",
+                                "profile=",
+                                "readonly",
+                                "pragma=",
                         ]
                 )
         except getopt.GetoptError:
@@ -75,19 +373,67 @@ def main(argv):
                 sys.exit(0)
 
         filepath = None
+        sql = None
+        path = None
+        transaction_size = 1
+        stop_on_error = True
+        catalog = None
+        profile = None
+        readonly = False
+        pragmas = []
 
         # Parse CLI options
         for opt, arg in opts:
                 if opt in ("-f", "--file"):
                         filepath = arg
+                elif opt in ("-e", "--execute"):
+                        sql = arg
+                elif opt in ("-i", "--input"):
+                        path = arg
+                elif opt in ("-t", "--transaction-size"):
+                        try:
+                                transaction_size = int(arg)
+                        except ValueError:
+                                error("Transaction size must be a number", True, USAGE_MESSAGE)
+                elif opt in ("-k", "--continue"):
+                        stop_on_error = False
+                elif opt == "--stop-on-error":
+                        stop_on_error = True
+                elif opt in ("-C", "--catalog"):
+                        catalog = arg
+                elif opt in ("-P", "--profile"):
+                        if arg not in PROFILES:
+                                error("Unknown profile %s, expected one of: %s" % (
+                                        arg, ', '.join(PROFILES),), True, USAGE_MESSAGE)
+                        profile = arg
+                elif opt == "--readonly":
+                        readonly = True
+                elif opt == "--pragma":
+                        m = _pragma_re.match(arg)
+                        if not m or m.group(2) is None:
+                                error("PRAGMAs must be given as <name>=<value>", True, USAGE_MESSAGE)
+                        pragmas.append((m.group(1).lower(), m.group(2)))
         if not filepath:
                 error("Please provide a DB filepath", True, USAGE_MESSAGE)
 
-        # Setup cursor
-        conn = sqlite3.connect(filepath)
-
         u = LiteUtility()
-        u.cursor = u.system_cursor = conn.cursor()
+        if profile:
+                u.profile = profile
+        u.readonly = readonly
+        u.pragmas.update(pragmas)
+        if catalog:
+                u.catalog = CatalogStore(catalog)
+        # Setup cursor, a glob matching several files turns on fan-out
+        # with the first file used for metadata
+        targets = u.expand_targets([filepath])
+        if not targets:
+                error("No files match %s" % (filepath,), True)
+        if not u.connect(targets[0]):
+                sys.exit(1)
+        if len(targets) > 1:
+                u.fanout_targets = targets
+        if sql or path:
+                sys.exit(not u.run_batch(sql, path, transaction_size, stop_on_error))
         u.cmdloop()
 
 if __name__ == "__main__":
@@ -8,12 +8,18 @@ __author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
 __docformat__ = 'restructuredtext en'
 __version__ = '0.1'
 
-import pyodbc
 import getopt
+import re
 import sys
 from urlparse import urlparse
 from pyDBCLI.utils import Utility
-from pyDBCLI.helpers import error, usage, memoized
+from pyDBCLI.helpers import error, usage
+from pyDBCLI.schema import SchemaModel, Column
+from pyDBCLI.catalog import CatalogStore
+
+# Credentials in an ODBC connection string, e.g. PWD=secret; or
+# Password={se;cret}; which are left out of cache namespaces
+_credentials_re = re.compile(r'(?:^|;)\s*(?:PWD|PASSWORD)\s*=\s*(?:\{(?:[^}]|\}\})*\}|[^;]*)', re.I)
 
 class ODBCUtility(Utility):
         prompt = 'odbc-qt# '
@@ -21,39 +27,91 @@ class ODBCUtility(Utility):
         query = ''
         dsn = {}
 
-        @memoized()
-        def get_tables(self):
-                tables = [['Table name']]
-                for row in self.cursor.tables():
-                        tables.append([row])
-                return tables
-
-        @memoized()
-        def get_columns(self, name):
-                columns = [['Column name', 'Type', 'Size',]]
-                r = self.cursor.execute('SELECT * FROM %s LIMIT 1' % (table,))
-                for row in r.cursor.description:
-                        columns.append([row[0], self.db_types[row[1]], row[3],])
-                return columns
-
-        def connect(self, schema):
-                self.dsn['schema'] = schema
+        def load_schema(self):
+                # One catalog call for the tables and one for every column,
+                # rather than a query per table, limited to the current
+                # schema (\c) if there is one
+                schema = self.current_dsn or None
+                model = SchemaModel(tables=[
+                        row.table_name for row in self.cursor.tables(schema=schema, tableType='TABLE,VIEW').fetchall()
+                ])
+                for row in self.cursor.columns(schema=schema).fetchall():
+                        model.add_column(Column(row.table_name, row.column_name, row.type_name,
+                                                row.column_size, bool(row.nullable), False,
+                                                row.ordinal_position))
+                return model
+
+        def prepare_import(self, cursor):
+                # pyodbc >= 4.0.19 can send each executemany() chunk as a
+                # parameter array in a single round-trip
+                if hasattr(cursor, 'fast_executemany'):
+                        cursor.fast_executemany = True
+
+        def table_exists(self, table):
+                return self.cursor.tables(table=table, schema=self.current_dsn or None).fetchone() is not None
+
+        def open_connection(self, schema):
+                dsn = dict(self.dsn)
+                if schema:
+                        dsn['schema'] = schema
+                # Only imported once connecting, so the driver's not loaded
+                # just to show usage or by other backends
+                import pyodbc
+                return pyodbc.connect(self.query, **dsn)
+
+        def get_plan(self, sql, params=None):
+                # Plans are fetched differently by each DBMS, the generic
+                # EXPLAIN <sql> suits PostgreSQL and MySQL
+                import pyodbc
+                from pyDBCLI.explain import PlanNode, indented_plan
                 try:
-                        conn = pyodbc.connect(self.query, **self.dsn)
-                        self.cursor = self.system_cursor = conn.cursor()
-                except:
-                        error(e, False)
-                        return False
-                else:
-                        return True
+                        dbms = self.cursor.connection.getinfo(pyodbc.SQL_DBMS_NAME).lower()
+                except Exception:
+                        dbms = ''
+                if 'sql server' in dbms:
+                        # Each statement's plan is returned as text rather
+                        # than running it, nested by "|--" steps
+                        self.cursor.execute('SET SHOWPLAN_TEXT ON')
+                        try:
+                                self.cursor.execute(sql, *(params or ()))
+                                lines = []
+                                while True:
+                                        lines.extend(row[0] for row in self.cursor.fetchall())
+                                        if not self.cursor.nextset():
+                                                break
+                        finally:
+                                self.cursor.execute('SET SHOWPLAN_TEXT OFF')
+                        return indented_plan(lines)
+                if 'sqlite' in dbms:
+                        rows = self.cursor.execute('EXPLAIN QUERY PLAN %s' % (sql,), *(params or ())).fetchall()
+                        return [PlanNode(row[0], row[1], row[3]) for row in rows]
+                return Utility.get_plan(self, sql, params)
+
+        def cache_namespace(self, schema):
+                # Namespaces are shown by \cache and written to the
+                # catalog, so keep passwords out of them
+                query = _credentials_re.sub('', self.query).strip(';')
+                if schema:
+                        return '%s (%s)' % (query, schema,)
+                return query
 
 # Shell script usage instrunctions, pushed to stdout
 # by usage()
 USAGE_MESSAGE = """ODBC Query Tool
-Usage: odbc.py -d <dsn>
+Usage: odbc.py -d <dsn> [-e <sql>] [-i <file>]
 
 Options:
     -d, --dsn : ODBC DSN, see your driver's documentation for more details
+    -e, --execute : SQL to run instead of starting the interactive prompt
+    -i, --input : File of SQL to run ('-' for STDIN) instead of starting the
+                  interactive prompt
+    -t, --transaction-size : Nr. of statements per transaction when running
+                             -e/-i, 0 for a single transaction (default 1)
+    -k, --continue : Carry on after a failed statement when running -e/-i
+    --stop-on-error : Roll back and stop at the first failed statement when
+                      running -e/-i (default)
+    -C, --catalog : File to keep a persistent cache of tables and columns in,
+                    shared between sessions
 """
 
 def main(argv):
@@ -64,9 +122,15 @@ def main(argv):
         try:
                 opts, args = getopt.getopt(
                         argv,
-                        "d:",
+                        "d:e:i:t:kC:",
                         [
                                 "dsn=",
+                                "execute=",
+                                "input=",
+                                "transaction-size=",
+                                "continue",
+                                "stop-on-error",
+                                "catalog=",
                         ]
                 )
         except getopt.GetoptError:
@@ -77,19 +141,43 @@ def main(argv):
                 sys.exit(0)
 
         dsn = None
+        sql = None
+        path = None
+        transaction_size = 1
+        stop_on_error = True
+        catalog = None
 
         # Parse CLI options
         for opt, arg in opts:
                 if opt in ("-d", "--dsn"):
                         dsn = arg
+                elif opt in ("-e", "--execute"):
+                        sql = arg
+                elif opt in ("-i", "--input"):
+                        path = arg
+                elif opt in ("-t", "--transaction-size"):
+                        try:
+                                transaction_size = int(arg)
+                        except ValueError:
+                                error("Transaction size must be a number", True, USAGE_MESSAGE)
+                elif opt in ("-k", "--continue"):
+                        stop_on_error = False
+                elif opt == "--stop-on-error":
+                        stop_on_error = True
+                elif opt in ("-C", "--catalog"):
+                        catalog = arg
         if not dsn:
                 error("Please provide a DSN", True, USAGE_MESSAGE)
 
-        # Setup cursor
-        conn = pyodbc.connect(dsn)
-
         u = ODBCUtility()
-        u.cursor = u.system_cursor = conn.cursor()
+        u.query = dsn
+        if catalog:
+                u.catalog = CatalogStore(catalog)
+        # Setup cursor, on the DSN's default schema
+        if not u.connect(''):
+                sys.exit(1)
+        if sql or path:
+                sys.exit(not u.run_batch(sql, path, transaction_size, stop_on_error))
         u.cmdloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,268 @@
+#-*- coding: utf-8 -*-
+
+"""Fan-out queries for pyDBCLI, running the same statement on many
+databases (e.g. SQLite shards) in parallel and merging the results
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import re
+import heapq
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from Queue import Queue, Empty, Full
+
+_order_re = re.compile(r'\bORDER\s+BY\s+((?:(?!\bORDER\s+BY\b)[^()])+?)(?:\s+LIMIT\s+(\d+))?\s*$', re.I | re.S)
+_limit_re = re.compile(r'\bLIMIT\s+(\d+)\s*$', re.I)
+_term_re = re.compile(r'^\s*(.+?)(?:\s+(ASC|DESC))?\s*$', re.I | re.S)
+
+
+def parse_order(sql):
+        """Find a simple trailing ORDER BY and/or LIMIT in sql, returning a
+        tuple of a list of (expression, descending) terms and the limit,
+        either of which may be empty/None.
+        """
+        m = _order_re.search(sql)
+        if m:
+                terms = []
+                for term in m.group(1).split(','):
+                        t = _term_re.match(term)
+                        terms.append((t.group(1), (t.group(2) or '').upper() == 'DESC'))
+                return terms, m.group(2) and int(m.group(2))
+        m = _limit_re.search(sql)
+        return [], m and int(m.group(1))
+
+
+class _Descending(object):
+        """Sort key wrapper reversing the order of value.
+        """
+        __slots__ = ('value',)
+
+        def __init__(self, value):
+                self.value = value
+
+        def __lt__(self, other):
+                return other.value < self.value
+
+        def __eq__(self, other):
+                return self.value == other.value
+
+
+def sort_key(keys, terms):
+        """Returns a key function for sorting rows with column names keys
+        by ORDER BY terms, or None if a term isn't a plain column name or
+        position in keys.
+        """
+        names = dict((k.lower(), i) for (i, k) in enumerate(keys))
+        columns = []
+        for expr, descending in terms:
+                expr = expr.strip().strip('"`[]')
+                if expr.isdigit() and 0 < int(expr) <= len(keys):
+                        i = int(expr) - 1
+                else:
+                        i = names.get(expr.lower(), names.get(expr.rsplit('.', 1)[-1].lower()))
+                if i is None:
+                        return None
+                columns.append((i, descending))
+        def key(row):
+                return tuple(descending and _Descending(row[i]) or row[i] for (i, descending) in columns)
+        return key
+
+
+class FanOut(object):
+        """Runs sql against every target, using up to workers threads each
+        with a connection of its own from connect(target). Results are read
+        with results(), which yields (target, keys, batch) tuples as workers
+        fetch them, through a bounded queue. Statements that don't return
+        rows are committed on each target.
+        """
+
+        def __init__(self, targets, sql, connect, workers=4, fetch_size=1000, params=None):
+                self.sql = sql
+                self.params = params
+                self.connect = connect
+                self.fetch_size = fetch_size
+                self.errors = []
+                self.cancelled = False
+                self._rowcounts = []
+                self._targets = Queue()
+                for target in targets:
+                        self._targets.put(target)
+                self._results = Queue(max(workers, 1) * 4)
+                self._stop = threading.Event()
+                self._cursors = {}
+                self._threads = [threading.Thread(target=self._work)
+                                 for i in range(min(workers, len(targets)))]
+                for thread in self._threads:
+                        thread.daemon = True
+
+        def start(self):
+                for thread in self._threads:
+                        thread.start()
+                return self
+
+        def _put(self, item):
+                while not self._stop.is_set():
+                        try:
+                                self._results.put(item, True, 0.1)
+                                return
+                        except Full:
+                                pass
+
+        def _work(self):
+                while not self._stop.is_set():
+                        try:
+                                target = self._targets.get_nowait()
+                        except Empty:
+                                break
+                        conn = None
+                        try:
+                                conn = self.connect(target)
+                                cursor = self._cursors[target] = conn.cursor()
+                                if self.params is None:
+                                        cursor = cursor.execute(self.sql) or cursor
+                                else:
+                                        cursor = cursor.execute(self.sql, self.params) or cursor
+                                if cursor.description:
+                                        keys = [d[0] for d in cursor.description]
+                                        while not self._stop.is_set():
+                                                batch = cursor.fetchmany(self.fetch_size)
+                                                if not batch:
+                                                        break
+                                                self._put((target, keys, batch))
+                                else:
+                                        self._rowcounts.append(max(cursor.rowcount, 0))
+                                        conn.commit()
+                        except Exception, e:
+                                self.errors.append((target, e))
+                        finally:
+                                self._cursors.pop(target, None)
+                                if conn is not None:
+                                        try:
+                                                conn.close()
+                                        except Exception:
+                                                pass
+                self._put(None)
+
+        def results(self, timeout=0.2):
+                """Generator yielding (target, keys, batch) tuples until every
+                worker has finished.
+                """
+                running = len(self._threads)
+                while running:
+                        try:
+                                item = self._results.get(True, timeout)
+                        except Empty:
+                                continue
+                        if item is None:
+                                running -= 1
+                        else:
+                                yield item
+
+        @property
+        def rowcount(self):
+                """Total rows affected, for statements without results.
+                """
+                return sum(self._rowcounts)
+
+        @property
+        def done(self):
+                return not [t for t in self._threads if t.is_alive()]
+
+        def join(self, timeout=None):
+                for thread in self._threads:
+                        thread.join(timeout)
+                return self.done
+
+        def cancel(self, interrupt=None):
+                """Stop the workers, calling interrupt(cursor) for each
+                statement still running.
+                """
+                self.cancelled = True
+                self._stop.set()
+                if interrupt is not None:
+                        for cursor in self._cursors.values():
+                                try:
+                                        interrupt(cursor)
+                                except Exception:
+                                        pass
+                try:
+                        while True:
+                                self._results.get_nowait()
+                except Empty:
+                        pass
+
+
+def merge(results, terms=(), limit=None, targets=()):
+        """Merge FanOut results into a tuple of the column names (with a
+        source column first) and an iterator of row batches, stopping
+        after limit rows.
+        If the ORDER BY terms (as per parse_order()) are all plain result
+        columns, each target's rows (already sorted by the target) are
+        kept in a queue of their own and merged in order with
+        heapq.merge, so rows stream out once every target has sent its
+        first batch rather than after every shard's result is read.
+        targets should list every target for this, otherwise all the
+        results are read before merging. Without an ORDER BY rows are
+        streamed as they arrive.
+        Returns (None, None) if no target returned rows.
+        """
+        results = iter(results)
+        for target, keys, batch in results:
+                break
+        else:
+                return None, None
+        merged_keys = ['source'] + list(keys)
+        order = terms and sort_key(keys, terms) or None
+        size = max(len(batch), 1)
+
+        if order is not None:
+                queues = OrderedDict((t, deque()) for t in targets)
+                queues.setdefault(target, deque()).append(batch)
+
+                def pull():
+                        # Read the next batch into its target's queue
+                        for t, k, b in results:
+                                queues.setdefault(t, deque()).append(b)
+                                return True
+                        return False
+                if not targets:
+                        while pull():
+                                pass
+
+                def stream(i, target):
+                        queue = queues[target]
+                        while queue or pull():
+                                if queue:
+                                        for row in queue.popleft():
+                                                yield order(row), i, target, row
+
+                def sorted_batches():
+                        rows = heapq.merge(*[stream(i, t) for (i, t) in enumerate(queues.keys())])
+                        b = []
+                        for key, i, t, row in islice(rows, limit):
+                                b.append([t] + list(row))
+                                if len(b) >= size:
+                                        yield b
+                                        b = []
+                        if b:
+                                yield b
+                return merged_keys, sorted_batches()
+
+        def rows():
+                yield [[target] + list(row) for row in batch]
+                for t, k, b in results:
+                        yield [[t] + list(row) for row in b]
+
+        def limited():
+                remaining = limit
+                for b in rows():
+                        if remaining is not None:
+                                b = b[:remaining]
+                                remaining -= len(b)
+                        yield b
+                        if remaining is not None and remaining <= 0:
+                                break
+        return merged_keys, limited()
@@ -6,10 +6,11 @@ __author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
 __docformat__ = 'restructuredtext en'
 __version__ = '0.1'
 
-import string
 import sys
 from functools import wraps
 
+from pyDBCLI.renderers import GridRenderer, VerticalRenderer
+
 def usage(msg):
         """Usage message to display when running from command line.
         """
@@ -25,6 +26,17 @@ def error(msg, fatal=False, usage_msg=None):
                     usage(usage_msg)
                 sys.exit(1)
 
+def progress(msg, done=False):
+        """Helper util to display a progress message to STDERR, overwriting
+        the previous one if STDERR is a terminal. Only the final message
+        (done=True) is shown otherwise.
+        """
+        if sys.stderr.isatty():
+                sys.stderr.write("\r%s%s" % (msg, done and '\n' or '',))
+                sys.stderr.flush()
+        elif done:
+                print >> sys.stderr, msg
+
 def print_table(rows, as_keys=False, header=True, vdelim="|", padding=1, justify='center'):
         """ Outputs a list of lists as a Restructured Text Table
 
@@ -35,55 +47,50 @@ def print_table(rows, as_keys=False, header=True, vdelim="|", padding=1, justify
           column
         - justify - may be left,center,right
         """
-
-        border = "-" # character for drawing the border
-        justify = {'left':string.ljust,'center':string.center, 'right':string.rjust}[justify.lower()]
-
-        # calculate column widhts (longest item in each col
-        # plus "padding" nr of spaces on both sides)
-        cols = zip(*rows)
-        col_widths = [max([len(str(item))+2*padding for item in col]) for col in cols]
-
-        # the horizontal border needed by rst
-        if as_keys:
-                borderline = '--'
+        if not rows:
+                return
+        keys, rows = rows[0], rows[1:]
+        renderer = table_renderer(as_keys, vdelim, padding, justify)
+        if rows:
+                renderer.render(keys, [rows], len(rows))
         else:
-                borderline = vdelim + vdelim.join([w*border for w in col_widths]) + vdelim
+                renderer.render_empty(keys)
 
-        # outputs table in rst format
-        print >> sys.stdout, borderline
-        # Just print out in dict() style, e.g. key: value
+def table_renderer(as_keys=False, vdelim="|", padding=1, justify='center'):
+        """Returns the renderer used by print_table.
+        """
         if as_keys:
-                keys = rows[0]
-                del rows[0]
-                for row in rows:
-                        for i, value in enumerate(row):
-                                print >> sys.stdout, str(keys[i]) + ': ' + str(value)
-                        print >> sys.stdout, borderline
-        else:
-                for row in rows:
-                        print >> sys.stdout, vdelim + vdelim.join([justify(str(item),width) for (item,width) in zip(row,col_widths)]) + vdelim
-                        print >> sys.stdout, borderline
+                return VerticalRenderer()
+        return GridRenderer(vdelim=vdelim, padding=padding, justify=justify)
 
 class memoized(object):
-        """Decorator that caches a function's return value each time it is called.
+        """Decorator that caches a method's return value each time it is called,
+        in the data_cache of the instance (normally a Utility) it's called on.
         If called later with the same arguments, the cached value is returned, and
         not re-evaluated.
-        Adapted from the Memoize example at:
-        http://wiki.python.org/moin/PythonDecoratorLibrary#Memoize
+        Cache keys are tuples of the method name and arguments, so arguments
+        need to be hashable, if not the method is just called uncached.
         """
         def __call__(self, fn):
+                name = fn.__name__
                 @wraps(fn)
-                def wrapper(*args, **kwargs):
-                        cache = args[0].data_cache
-                        key = str(fn)+str(args)+str(kwargs)
+                def wrapper(self, *args, **kwargs):
+                        cache = self.data_cache
                         try:
+                                key = (name, args, tuple(sorted(kwargs.items())))
                                 return cache[key]
                         except KeyError:
-                                cache[key] = value = fn(*args)
+                                # Let the instance look elsewhere before
+                                # calling fn, e.g. in a persistent catalog
+                                miss = getattr(self, 'metadata_miss', None)
+                                if miss is None:
+                                        value = fn(self, *args, **kwargs)
+                                else:
+                                        value = miss(fn, key, args, kwargs)
+                                cache[key] = value
                                 return value
                         except TypeError:
                                 # uncachable -- for instance, passing a list as an argument.
                                 # Better to not cache than to blow up entirely.
-                                return fn(*args)
+                                return fn(self, *args, **kwargs)
                 return wrapper
@@ -0,0 +1,147 @@
+#-*- coding: utf-8 -*-
+
+"""Query execution in worker threads for pyDBCLI, so queries can be
+supervised, cancelled, or left running in the background
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+
+class QueryJob(object):
+        """Runs a query on a DBAPI cursor in a worker thread.
+
+        By default row batches (from fetchmany()) are passed back through a
+        bounded queue, read with batches(), so at most max_batches are held
+        in memory. With collect=True rows are instead kept in self.rows,
+        up to max_rows of them, for jobs left running in the background.
+        """
+
+        def __init__(self, cursor, sql, fetch_size=1000, max_batches=4,
+                     collect=False, max_rows=None, params=None):
+                self.cursor = cursor
+                self.sql = sql
+                self.params = params
+                self.fetch_size = fetch_size
+                self.collect = collect
+                self.max_rows = max_rows
+                # Column names, None for statements without a result set
+                self.keys = None
+                self.rowcount = -1
+                self.fetched = 0
+                self.rows = []
+                self.error = None
+                self.cancelled = False
+                self.done = False
+                self.started = None
+                self.finished = None
+                self._ready = threading.Event()
+                self._queue = Queue(max_batches)
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+
+        def start(self):
+                self.started = time.time()
+                self._thread.start()
+                return self
+
+        @property
+        def elapsed(self):
+                return (self.finished or time.time()) - self.started
+
+        @property
+        def status(self):
+                if not self.done:
+                        return 'running'
+                if self.cancelled:
+                        return 'cancelled'
+                if self.error is not None:
+                        return 'failed'
+                return 'done'
+
+        def _put(self, item):
+                # Don't block forever if the reader has gone away
+                while not self.cancelled:
+                        try:
+                                self._queue.put(item, True, 0.1)
+                                return
+                        except Full:
+                                pass
+
+        def _run(self):
+                try:
+                        if self.params is None:
+                                cursor = self.cursor.execute(self.sql) or self.cursor
+                        else:
+                                cursor = self.cursor.execute(self.sql, self.params) or self.cursor
+                        self.rowcount = getattr(cursor, 'rowcount', -1)
+                        if cursor.description:
+                                self.keys = [d[0] for d in cursor.description]
+                        self._ready.set()
+                        while self.keys and not self.cancelled:
+                                batch = cursor.fetchmany(self.fetch_size)
+                                if not batch:
+                                        break
+                                self.fetched += len(batch)
+                                if not self.collect:
+                                        self._put(batch)
+                                elif self.max_rows is None or len(self.rows) < self.max_rows:
+                                        self.rows.extend(batch[:self.max_rows and self.max_rows - len(self.rows)])
+                except Exception, e:
+                        self.error = e
+                finally:
+                        self.finished = time.time()
+                        self.done = True
+                        self._ready.set()
+                        if not self.collect:
+                                self._put(None)
+
+        def wait(self, timeout=None):
+                """Wait until the query has been executed (not necessarily
+                fetched), returning True if it has.
+                """
+                self._ready.wait(timeout)
+                return self._ready.is_set()
+
+        def join(self, timeout=None):
+                self._thread.join(timeout)
+                return self.done
+
+        def batches(self, timeout=0.2, waiting=None):
+                """Generator yielding row batches as the worker fetches them,
+                calling waiting() every timeout seconds while there are none
+                ready. Raises the query's error, if it failed.
+                """
+                while True:
+                        try:
+                                batch = self._queue.get(True, timeout)
+                        except Empty:
+                                if waiting is not None:
+                                        waiting()
+                                continue
+                        if batch is None:
+                                break
+                        yield batch
+                if self.error is not None and not self.cancelled:
+                        raise self.error
+
+        def cancel(self, interrupt=None):
+                """Stop fetching, calling interrupt(cursor) (e.g. the driver's
+                cancel method) to abort a statement that's still executing.
+                """
+                self.cancelled = True
+                if interrupt is not None and not self.done:
+                        try:
+                                interrupt(self.cursor)
+                        except Exception:
+                                pass
+                # Unblock the worker if it's waiting to hand over a batch
+                try:
+                        while True:
+                                self._queue.get_nowait()
+                except Empty:
+                        pass
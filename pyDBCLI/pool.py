@@ -0,0 +1,99 @@
+#-*- coding: utf-8 -*-
+
+"""Connection pooling for pyDBCLI, so \\c can switch between schemas
+without reconnecting
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import time
+from collections import OrderedDict
+
+
+def ping(conn):
+        """Default health check, runs a trivial query on the connection.
+        """
+        cursor = conn.cursor()
+        try:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+        finally:
+                cursor.close()
+
+
+class ConnectionPool(object):
+        """Bounded pool of open DBAPI connections, keyed by DSN or schema.
+
+        At most max_size connections are kept open, the least recently used
+        closed first, and connections idle for more than idle_timeout
+        seconds are closed by prune(). Connections idle for more than
+        ping_after seconds are health checked with ping() before being
+        reused, and replaced if that fails.
+        """
+
+        def __init__(self, max_size=8, idle_timeout=600, ping_after=30, ping=ping):
+                self.max_size = max_size
+                self.idle_timeout = idle_timeout
+                self.ping_after = ping_after
+                self.ping = ping
+                # key -> [connection, time opened, time last used]
+                self._entries = OrderedDict()
+
+        def get(self, key, factory):
+                """Returns an open connection for key, reusing a pooled one if
+                it's healthy, or calling factory() to open a new one.
+                """
+                now = time.time()
+                entry = self._entries.pop(key, None)
+                if entry is not None and now - entry[2] > self.ping_after:
+                        try:
+                                self.ping(entry[0])
+                        except Exception:
+                                self._close(entry)
+                                entry = None
+                if entry is None:
+                        entry = [factory(), now, now]
+                entry[2] = now
+                self._entries[key] = entry
+                while len(self._entries) > self.max_size:
+                        self._close(self._entries.popitem(last=False)[1])
+                return entry[0]
+
+        def prune(self, keep=None):
+                """Close connections idle for longer than idle_timeout, other
+                than the one for keep.
+                """
+                if not self.idle_timeout:
+                        return
+                limit = time.time() - self.idle_timeout
+                for key, entry in self._entries.items():
+                        if key != keep and entry[2] < limit:
+                                self._close(self._entries.pop(key))
+
+        def touch(self, key):
+                """Mark the connection for key as used now.
+                """
+                if key in self._entries:
+                        self._entries[key][2] = time.time()
+
+        def close(self, key):
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                        self._close(entry)
+
+        def close_all(self):
+                while self._entries:
+                        self._close(self._entries.popitem()[1])
+
+        def _close(self, entry):
+                try:
+                        entry[0].close()
+                except Exception:
+                        pass
+
+        def entries(self):
+                """Returns a list of (key, time opened, time last used)
+                tuples, from least to most recently used.
+                """
+                return [(key, entry[1], entry[2]) for (key, entry) in self._entries.items()]
@@ -0,0 +1,73 @@
+#-*- coding: utf-8 -*-
+
+"""Registries of pyDBCLI backends and special commands, given as
+'module:attribute' strings which are only imported when first used, so
+e.g. pyodbc isn't loaded unless the odbc backend is chosen
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+from collections import OrderedDict
+
+
+def load(target):
+        """Import and return the object named by a 'module:attribute'
+        string, e.g. 'pyDBCLI.extras.litecli:main'.
+        """
+        module, sep, attr = target.partition(':')
+        obj = __import__(module, fromlist=[attr or '__name__'])
+        for name in attr.split('.'):
+                if name:
+                        obj = getattr(obj, name)
+        return obj
+
+
+class Registry(object):
+        """Names mapped to objects, or to 'module:attribute' strings which
+        are imported (once) when the name is first looked up.
+        """
+
+        def __init__(self, entries=()):
+                self._entries = OrderedDict(entries)
+                self._loaded = {}
+
+        def register(self, name, target):
+                self._entries[name] = target
+                self._loaded.pop(name, None)
+
+        def unregister(self, name):
+                del self._entries[name]
+                self._loaded.pop(name, None)
+
+        def names(self):
+                return self._entries.keys()
+
+        def __contains__(self, name):
+                return name in self._entries
+
+        def __len__(self):
+                return len(self._entries)
+
+        def get(self, name):
+                """Returns the object registered as name, importing it if
+                needed. Raises KeyError if nothing is.
+                """
+                try:
+                        return self._loaded[name]
+                except KeyError:
+                        target = self._entries[name]
+                obj = isinstance(target, basestring) and load(target) or target
+                self._loaded[name] = obj
+                return obj
+
+
+# Backends run by the pydbcli command, each a main(argv) function for
+# its CLI
+backends = Registry([
+        ('sqlite', 'pyDBCLI.extras.litecli:main'),
+        ('odbc', 'pyDBCLI.extras.odbc:main'),
+])
+# Extra special commands for every Utility, e.g. \foo, each a function
+# taking the Utility and the rest of the line, like a do_foo method
+commands = Registry()
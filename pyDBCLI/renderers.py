@@ -0,0 +1,288 @@
+#-*- coding: utf-8 -*-
+
+"""Output renderers for pyDBCLI result sets
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import sys
+import csv
+import binascii
+import json
+import string
+
+# Types of values that may be binary data, see Renderer.is_binary()
+_byte_types = frozenset([str, buffer, bytearray])
+
+
+class Renderer(object):
+        """Base class for result set renderers.
+
+        Each cell is converted to text exactly once, and output is collected
+        and written to *stream* in chunks of at least buffer_size bytes, so
+        dumping a large result to a pipe or file isn't dominated by syscalls.
+        Subclasses implement begin() and write_rows().
+        """
+        # Name used to select this renderer with \\format
+        name = None
+        # Text used for NULL values
+        null = ''
+        # Encoding used for unicode values
+        encoding = 'utf-8'
+        # Nr. of bytes collected before writing to stream
+        buffer_size = 65536
+        # Whether a "N found." summary should follow the output
+        footer = True
+        # Whether stream is flushed after every batch of rows, so they're
+        # seen straight away, turned off for e.g. compressed file output
+        flush_stream = True
+        # Whether binary values (see is_binary()) are output as hex digits
+        # rather than raw bytes
+        hex_binary = False
+
+        def __init__(self, stream=None):
+                self.stream = stream or sys.stdout
+                self.bytes_written = 0
+                self._buffer = []
+                self._buffered = 0
+
+        def write(self, text):
+                """Buffered write to the output stream.
+                """
+                self._buffer.append(text)
+                self._buffered += len(text)
+                if self._buffered >= self.buffer_size:
+                        self.flush()
+
+        def flush(self):
+                """Write out anything buffered so far.
+                """
+                if self._buffer:
+                        data = ''.join(self._buffer)
+                        self.stream.write(data)
+                        self.bytes_written += len(data)
+                        self._buffer = []
+                        self._buffered = 0
+                if self.flush_stream:
+                        self.stream.flush()
+
+        def format(self, value):
+                """Convert a single cell value to text.
+                """
+                if value is None:
+                        return self.null
+                if isinstance(value, unicode):
+                        return value.encode(self.encoding)
+                if type(value) in _byte_types and self.hex_binary and self.is_binary(value):
+                        return binascii.hexlify(value)
+                return str(value)
+
+        def is_binary(self, value):
+                """Whether value is binary data rather than text, i.e. a
+                buffer or bytearray (e.g. a BLOB), or a str containing NULs
+                or not in the output encoding.
+                """
+                if isinstance(value, (buffer, bytearray)):
+                        return True
+                if isinstance(value, str):
+                        if '\0' in value:
+                                return True
+                        try:
+                                value.decode(self.encoding)
+                        except UnicodeDecodeError:
+                                return True
+                return False
+
+        def format_row(self, row):
+                format = self.format
+                return [format(v) for v in row]
+
+        def begin(self, keys, sample):
+                """Output anything needed before the first row, *sample* is
+                the first few formatted rows, e.g. to estimate column widths.
+                """
+                pass
+
+        def write_rows(self, rows):
+                """Output a list of formatted rows.
+                """
+                raise NotImplementedError
+
+        def end(self):
+                """Output anything needed after the last row.
+                """
+                pass
+
+        def render_empty(self, keys):
+                """Render just the header for the column names *keys*, for
+                when there are no rows but output is still wanted.
+                """
+                self.begin([self.format(k) for k in keys], [])
+                self.end()
+                self.flush()
+
+        def render(self, keys, batches, sample_size=100):
+                """Render an iterable of row batches with the column names
+                *keys*, returning the nr. of rows rendered.
+                Nothing is output if there are no rows.
+                """
+                batches = iter(batches)
+                sample = []
+                for batch in batches:
+                        sample.extend(self.format_row(row) for row in batch)
+                        if len(sample) >= sample_size:
+                                break
+                if not sample:
+                        return 0
+
+                self.begin([self.format(k) for k in keys], sample[:sample_size])
+                self.write_rows(sample)
+                count = len(sample)
+                del sample
+                self.flush()
+                format_row = self.format_row
+                for batch in batches:
+                        self.write_rows([format_row(row) for row in batch])
+                        count += len(batch)
+                        self.flush()
+                self.end()
+                self.flush()
+                return count
+
+
+class GridRenderer(Renderer):
+        """Restructured Text style table, with column widths estimated from
+        the sample rows.
+        """
+        name = 'aligned'
+        null = 'None'
+        border = '-'
+
+        def __init__(self, stream=None, vdelim='|', padding=1, justify='center'):
+                Renderer.__init__(self, stream)
+                self.vdelim = vdelim
+                self.padding = padding
+                self.justify = {'left':string.ljust, 'center':string.center,
+                                'right':string.rjust}[justify.lower()]
+
+        def begin(self, keys, sample):
+                padding = 2 * self.padding
+                self.col_widths = col_widths = [len(k) + padding for k in keys]
+                for row in sample:
+                        for i, item in enumerate(row):
+                                width = len(item) + padding
+                                if width > col_widths[i]:
+                                        col_widths[i] = width
+                vdelim = self.vdelim
+                self.borderline = vdelim + vdelim.join([w*self.border for w in col_widths]) + vdelim + '\n'
+                self.write(self.borderline)
+                self.write_rows([keys])
+
+        def write_rows(self, rows):
+                vdelim = self.vdelim
+                justify = self.justify
+                col_widths = self.col_widths
+                borderline = self.borderline
+                self.write(''.join([
+                        vdelim + vdelim.join([justify(item, width) for (item, width) in zip(row, col_widths)]) + vdelim + '\n' + borderline
+                        for row in rows
+                ]))
+
+
+class VerticalRenderer(Renderer):
+        """Rows output in dict() style, e.g. key: value, used by the
+        aligned format when vertical display mode is on.
+        """
+        name = 'vertical'
+        null = 'None'
+        borderline = '--\n'
+
+        def begin(self, keys, sample):
+                self.keys = [k + ': ' for k in keys]
+                self.write(self.borderline)
+
+        def write_rows(self, rows):
+                keys = self.keys
+                borderline = self.borderline
+                self.write(''.join([
+                        ''.join([k + v + '\n' for (k, v) in zip(keys, row)]) + borderline
+                        for row in rows
+                ]))
+
+
+class UnalignedRenderer(Renderer):
+        """Header and rows with cells separated by a delimiter and no padding.
+        """
+        name = 'unaligned'
+        delimiter = '|'
+
+        def begin(self, keys, sample):
+                self.write_rows([keys])
+
+        def write_rows(self, rows):
+                delimiter = self.delimiter
+                self.write(''.join([delimiter.join(row) + '\n' for row in rows]))
+
+
+class CSVRenderer(Renderer):
+        """Comma separated values, with a header row. Binary values are
+        written as hex digits, as the csv module stops at a NUL byte.
+        """
+        name = 'csv'
+        dialect = 'excel'
+        footer = False
+        hex_binary = True
+
+        def begin(self, keys, sample):
+                self.writer = csv.writer(self, dialect=self.dialect, lineterminator='\n')
+                self.writer.writerow(keys)
+
+        def write_rows(self, rows):
+                self.writer.writerows(rows)
+
+
+class TSVRenderer(CSVRenderer):
+        """Tab separated values, with a header row.
+        """
+        name = 'tsv'
+        dialect = 'excel-tab'
+
+
+class JSONLinesRenderer(Renderer):
+        """One JSON object per row, keyed by column name. Binary values
+        are written as strings of hex digits, to keep the output valid
+        JSON.
+        """
+        name = 'jsonl'
+        footer = False
+
+        def format(self, value):
+                if value is None or isinstance(value, (bool, int, long, float)):
+                        return json.dumps(value)
+                if isinstance(value, unicode):
+                        return json.dumps(value, ensure_ascii=False).encode(self.encoding)
+                if type(value) in _byte_types and self.is_binary(value):
+                        return '"%s"' % (binascii.hexlify(value),)
+                return json.dumps(str(value), ensure_ascii=False)
+
+        def begin(self, keys, sample):
+                self.keys = [k + ': ' for k in keys]
+
+        def write_rows(self, rows):
+                keys = self.keys
+                self.write(''.join([
+                        '{' + ', '.join([k + v for (k, v) in zip(keys, row)]) + '}\n'
+                        for row in rows
+                ]))
+
+
+# Available renderers, by name, as selectable with \format
+renderers = dict((r.name, r) for r in (
+        GridRenderer,
+        VerticalRenderer,
+        UnalignedRenderer,
+        CSVRenderer,
+        TSVRenderer,
+        JSONLinesRenderer,
+))
@@ -0,0 +1,83 @@
+#-*- coding: utf-8 -*-
+
+"""In-memory schema model for pyDBCLI, loaded from the database catalog
+in bulk and indexed for metadata lookups
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+from fnmatch import fnmatchcase
+from collections import namedtuple
+
+# Metadata for a single column, size and nullable may be None if unknown
+Column = namedtuple('Column', 'table name type size nullable primary_key position')
+
+
+class SchemaModel(object):
+        """Tables and their columns, indexed by (case insensitive) table name
+        and column name, so \\d and column lookups don't need to query the
+        database.
+        """
+
+        def __init__(self, tables=(), columns=()):
+                # Table name -> list of Columns, in position order
+                self.tables = {}
+                # Lower case table name -> table name
+                self._table_names = {}
+                # Lower case column name -> list of Columns
+                self._columns = {}
+                for table in tables:
+                        self.add_table(table)
+                for column in columns:
+                        self.add_column(column)
+
+        def add_table(self, table):
+                if table not in self.tables:
+                        self.tables[table] = []
+                        self._table_names[table.lower()] = table
+
+        def add_column(self, column):
+                self.add_table(column.table)
+                self.tables[column.table].append(column)
+                self._columns.setdefault(column.name.lower(), []).append(column)
+
+        def table_names(self):
+                return sorted(self.tables)
+
+        def column_names(self):
+                """Returns the distinct column names across all tables.
+                """
+                return set(c[0].name for c in self._columns.itervalues())
+
+        def table(self, name):
+                """Returns the real name of the table name, matched case
+                insensitively, or None if there's no such table.
+                """
+                if name in self.tables:
+                        return name
+                return self._table_names.get(name.lower())
+
+        def columns(self, table):
+                """Returns the list of Columns for table, matched case
+                insensitively.
+                """
+                table = self.table(table)
+                if table is None:
+                        return []
+                return sorted(self.tables[table], key=lambda c: c.position)
+
+        def find_columns(self, name):
+                """Returns a list of Columns called name (case insensitive) in
+                any table, name may contain shell style wildcards, e.g. *_id
+                """
+                name = name.lower()
+                if '*' in name or '?' in name or '[' in name:
+                        found = []
+                        for key, columns in self._columns.iteritems():
+                                if fnmatchcase(key, name):
+                                        found.extend(columns)
+                else:
+                        found = list(self._columns.get(name, ()))
+                found.sort(key=lambda c: (c.table, c.position))
+                return found
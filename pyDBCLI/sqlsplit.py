@@ -0,0 +1,280 @@
+#-*- coding: utf-8 -*-
+
+"""Incremental SQL statement splitting for pyDBCLI
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import re
+
+# Start of anything that changes the lexer state, or ends a statement
+_normal_re = re.compile(r"""[;'"`\[]|--|/\*|\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$""")
+# End of each quoted state, keyed by the token that started it
+_end_res = {
+        "'": re.compile(r"'"),
+        '"': re.compile(r'"'),
+        '`': re.compile(r'`'),
+        '[': re.compile(r'\]'),
+        '--': re.compile(r'\n'),
+        '/*': re.compile(r'\*/'),
+}
+# Quotes which can be escaped by doubling them up, e.g. 'it''s'
+_doubled = ("'", '"', '`')
+# Words in code, to find the start of a statement and BEGIN ... END
+# blocks in triggers
+_block_word_re = re.compile(r'[A-Za-z_][A-Za-z_0-9$]*')
+# First keyword of a statement, after any leading comments
+_keyword_re = re.compile(r'(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*([A-Za-z]+)', re.S)
+
+# Strings, quoted identifiers and comments, which normalize() and
+# cacheable() leave alone
+_literal_re = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\]|--[^\n]*|/\*.*?\*/"""
+                         r"""|(\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$).*?\1""", re.S)
+_word_re = re.compile(r'[A-Za-z_]+')
+_space_re = re.compile(r'\s+')
+# :name bind variable references, but not e.g. PostgreSQL ::type casts
+_bind_re = re.compile(r'(?<![:\w]):([A-Za-z_][A-Za-z_0-9]*)')
+
+# Statements that change the schema
+DDL_KEYWORDS = frozenset(['CREATE', 'ALTER', 'DROP', 'RENAME'])
+# Statements that only read, unless they contain one of WRITE_KEYWORDS
+READ_KEYWORDS = frozenset(['SELECT', 'VALUES', 'WITH'])
+WRITE_KEYWORDS = frozenset(['INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'MERGE', 'UPSERT', 'INTO',
+                            'CREATE', 'ALTER', 'DROP', 'ATTACH', 'DETACH', 'PRAGMA', 'VACUUM'])
+# Functions whose results change from one call to the next
+VOLATILE_KEYWORDS = frozenset(['RANDOM', 'RANDOMBLOB', 'NEWID', 'UUID', 'CHANGES', 'TOTAL_CHANGES',
+                               'LAST_INSERT_ROWID', 'NOW', 'SYSDATE', 'GETDATE', 'CURRENT_DATE',
+                               'CURRENT_TIME', 'CURRENT_TIMESTAMP', 'LOCALTIME', 'LOCALTIMESTAMP'])
+
+
+class StatementSplitter(object):
+        """Incremental lexer that splits SQL input into complete statements.
+
+        Lexer state (whether we're inside a string, quoted identifier,
+        comment or dollar-quoted block) is kept between calls to feed(), so
+        each character of input is only scanned once and ';' characters
+        inside quotes or comments don't end a statement.
+
+        Input should be fed a line at a time (or in any other chunks that
+        don't split a token such as ``--`` in two).
+
+        Input that's only whitespace or comments isn't a statement, and is
+        dropped rather than prepended to the next one. In CREATE TRIGGER
+        statements, ';' characters inside BEGIN ... END don't end the
+        statement.
+        """
+
+        def __init__(self):
+                self.reset()
+
+        def reset(self):
+                """Throw away any incomplete statement and lexer state.
+                """
+                self._pieces = []
+                self._state = None
+                self._end_statement()
+
+        def _end_statement(self):
+                # Whether there's any code (not just whitespace and
+                # comments) buffered, the first few words of it, and the
+                # depth of BEGIN (or CASE) ... END blocks in a trigger
+                self._code = False
+                self._words = []
+                self._depth = 0
+
+        @property
+        def pending(self):
+                """True if there's an incomplete statement buffered.
+                """
+                return self._code or self._state == '/*'
+
+        @property
+        def buffer(self):
+                """Text of the incomplete statement buffered so far.
+                """
+                return ''.join(self._pieces)
+
+        def _append(self, text):
+                if text:
+                        self._pieces.append(text)
+
+        def _scan(self, code):
+                """Note a piece of code, outside strings and comments.
+                """
+                if not code.strip():
+                        return
+                self._code = True
+                words = _block_word_re.findall(code)
+                if len(self._words) < 3:
+                        self._words.extend(w.upper() for w in words[:3])
+                if self._words[:1] == ['CREATE'] and 'TRIGGER' in self._words[1:3]:
+                        for word in words:
+                                word = word.upper()
+                                if word in ('BEGIN', 'CASE'):
+                                        self._depth += 1
+                                elif word == 'END' and self._depth:
+                                        self._depth -= 1
+
+        def feed(self, text):
+                """Feed a chunk of input to the lexer, returning a list of the
+                statements completed by it, without the terminating ';'.
+                """
+                statements = []
+                pos = 0
+                start = 0
+                end = len(text)
+                while pos < end:
+                        state = self._state
+                        if state is None:
+                                m = _normal_re.search(text, pos)
+                                if not m:
+                                        self._scan(text[pos:])
+                                        break
+                                self._scan(text[pos:m.start()])
+                                token = m.group(0)
+                                if token == ';':
+                                        if not self._depth:
+                                                self._append(text[start:m.start()])
+                                                if self._code:
+                                                        statements.append(self.buffer.strip())
+                                                self._pieces = []
+                                                self._end_statement()
+                                                start = m.end()
+                                elif token in ('--', '/*'):
+                                        self._state = token
+                                else:
+                                        # Strings and quoted identifiers are code
+                                        self._code = True
+                                        self._state = token
+                                pos = m.end()
+                        else:
+                                end_re = _end_res.get(state)
+                                if end_re is None:
+                                        # Dollar quoted, ended by the same $tag$
+                                        i = text.find(state, pos)
+                                        if i == -1:
+                                                break
+                                        pos = i + len(state)
+                                        self._state = None
+                                        continue
+                                m = end_re.search(text, pos)
+                                if not m:
+                                        break
+                                pos = m.end()
+                                if state in _doubled and text[pos:pos+1] == state:
+                                        # Escaped quote, still inside the string
+                                        pos += 1
+                                        continue
+                                self._state = None
+                self._append(text[start:])
+                if not self.pending:
+                        # Nothing but whitespace and comments
+                        self._pieces = []
+                return statements
+
+
+def split(text):
+        """Split a complete SQL script into a list of statements, any
+        trailing unterminated statement is included as the last item.
+        """
+        splitter = StatementSplitter()
+        statements = []
+        for line in text.splitlines(True):
+                statements.extend(splitter.feed(line))
+        remainder = splitter.buffer.strip()
+        if remainder:
+                statements.append(remainder)
+        return statements
+
+def statement_kind(sql):
+        """Returns the first keyword of a statement in upper case, e.g.
+        SELECT or CREATE, or an empty string if there isn't one.
+        """
+        m = _keyword_re.match(sql)
+        return m and m.group(1).upper() or ''
+
+def _code(sql):
+        """Generator yielding (is_code, text) pieces of sql, where pieces
+        that aren't code are strings, quoted identifiers or comments.
+        """
+        pos = 0
+        for m in _literal_re.finditer(sql):
+                yield True, sql[pos:m.start()]
+                yield False, m.group(0)
+                pos = m.end()
+        yield True, sql[pos:]
+
+def normalize(sql):
+        """Returns sql with comments removed, runs of whitespace outside
+        of strings and quoted identifiers collapsed to a single space and
+        any trailing ';' removed, e.g. as a cache key.
+        """
+        # Comments first, so whitespace either side of them is collapsed
+        pieces = []
+        for is_code, text in _code(sql):
+                if not is_code and text.startswith(('--', '/*')):
+                        text = ' '
+                pieces.append(text)
+        sql = ''.join(pieces)
+        pieces = []
+        for is_code, text in _code(sql):
+                pieces.append(is_code and _space_re.sub(' ', text) or text)
+        return ''.join(pieces).strip().rstrip(';').rstrip()
+
+def _words(sql):
+        """Returns the set of upper case words in the code (not strings,
+        quoted identifiers or comments) of sql, plus any 'now' or
+        'localtime' string literals, as used by SQLite's date functions.
+        """
+        words = set()
+        for is_code, text in _code(sql):
+                if is_code:
+                        words.update(w.upper() for w in _word_re.findall(text))
+                elif text.lower() in ("'now'", "'localtime'"):
+                        words.add('NOW')
+        return words
+
+def read_only(sql):
+        """True if sql is a query that can't write anything, e.g. a SELECT
+        with no writes in a CTE or SELECT INTO.
+        """
+        return statement_kind(sql) in READ_KEYWORDS and not _words(sql) & WRITE_KEYWORDS
+
+def cacheable(sql):
+        """True if sql is read_only() and doesn't call any of the
+        VOLATILE_KEYWORDS functions, so its results only change if the
+        data does.
+        """
+        if statement_kind(sql) not in READ_KEYWORDS:
+                return False
+        words = _words(sql)
+        return not (words & WRITE_KEYWORDS or words & VOLATILE_KEYWORDS)
+
+def bind(sql, names=None, placeholder='?'):
+        """Replace :name references in the code of sql (not strings, quoted
+        identifiers or comments) with placeholder, returning a tuple of the
+        new SQL and the list of names replaced, in order, to look up the
+        parameter values with. If names is given only those names are
+        replaced, others are left as they are. For placeholders using
+        %, e.g. the format paramstyle's %s, other % characters are doubled
+        up.
+        """
+        found = []
+        def replace(m):
+                name = m.group(1)
+                if names is not None and name not in names:
+                        return m.group(0)
+                found.append(name)
+                return placeholder
+        escape = '%' in placeholder
+        pieces = []
+        for is_code, text in _code(sql):
+                if escape:
+                        text = text.replace('%', '%%')
+                if is_code:
+                        text = _bind_re.sub(replace, text)
+                pieces.append(text)
+        if not found:
+                return sql, found
+        return ''.join(pieces), found
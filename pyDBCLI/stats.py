@@ -0,0 +1,225 @@
+#-*- coding: utf-8 -*-
+
+"""Per-statement timing of pyDBCLI queries, and session histograms of
+those timings, see \\timing and \\stats
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+import time
+
+# Phases timed for every statement, in the order they happen. first_row
+# is the latency from the start of execution to the first row fetched,
+# the others don't overlap so add up to (roughly) total.
+PHASES = ('parse', 'execute', 'first_row', 'fetch', 'render', 'total')
+# Counters recorded alongside the phase timings
+COUNTERS = ('rows', 'bytes')
+
+
+class QueryTimer(object):
+        """Times the phases of running a single statement. Time spent
+        waiting for row batches is counted by wrapping the batch iterator
+        with batches(), so the cost is per batch rather than per row.
+        """
+
+        def __init__(self, sql, parse=0.0):
+                self.sql = sql
+                self.started = time.time()
+                self.times = dict.fromkeys(PHASES, 0.0)
+                self.times['parse'] = parse
+                self.times['first_row'] = None
+                self.rows = 0
+                self.bytes = 0
+                self.error = None
+                self._mark = self.started
+
+        def lap(self, phase):
+                """Add the time since the last lap (or the start) to phase.
+                """
+                now = time.time()
+                self.times[phase] += now - self._mark
+                self._mark = now
+
+        def batches(self, batches):
+                """Generator passing through row batches, adding the time
+                spent fetching each one to the fetch phase.
+                """
+                fetch = 0.0
+                batches = iter(batches)
+                try:
+                        while True:
+                                started = time.time()
+                                try:
+                                        batch = next(batches)
+                                except StopIteration:
+                                        break
+                                finally:
+                                        fetch += time.time() - started
+                                if self.times['first_row'] is None:
+                                        self.times['first_row'] = time.time() - self.started
+                                yield batch
+                finally:
+                        self.times['fetch'] += fetch
+
+        def finish(self, rows=0, bytes=0, error=None):
+                """Stop timing, counting anything since the last lap as
+                rendering (less the time spent fetching), or as executing if
+                the statement never got that far.
+                """
+                now = time.time()
+                if self._mark == self.started:
+                        self.times['execute'] = now - self.started
+                else:
+                        self.times['render'] = max(now - self._mark - self.times['fetch'], 0.0)
+                self.times['total'] = now - self.started + self.times['parse']
+                self.rows = rows
+                self.bytes = bytes
+                self.error = error
+                return self
+
+        def as_dict(self):
+                """Returns the timings (in seconds) and counters as a dict,
+                e.g. for logging.
+                """
+                metrics = dict(self.times)
+                metrics.update(sql=self.sql, rows=self.rows, bytes=self.bytes,
+                               started=self.started, error=self.error and str(self.error))
+                return metrics
+
+        def summary(self):
+                times = self.times
+                parts = ['%s %s' % (phase.replace('_', ' '), format_seconds(times[phase]))
+                         for phase in ('parse', 'execute', 'fetch', 'render')]
+                text = "Time: %s (%s)" % (format_seconds(times['total']), ', '.join(parts))
+                if times['first_row'] is not None:
+                        text += ", first row after %s" % (format_seconds(times['first_row']),)
+                return "%s, %d rows, %s" % (text, self.rows, format_bytes(self.bytes))
+
+
+class Histogram(object):
+        """Counts of values in power of 2 buckets, plus exact count, total,
+        min. and max. Values are scaled by scale (e.g. 1e6 for seconds to
+        microseconds) to integer units before bucketing.
+        """
+
+        def __init__(self, scale=1):
+                self.scale = scale
+                self.buckets = {}
+                self.count = 0
+                self.total = 0
+                self.min = None
+                self.max = None
+
+        def add(self, value):
+                bucket = int(value * self.scale).bit_length()
+                self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+                self.count += 1
+                self.total += value
+                if self.min is None or value < self.min:
+                        self.min = value
+                if self.max is None or value > self.max:
+                        self.max = value
+
+        @property
+        def mean(self):
+                return self.count and float(self.total) / self.count or 0
+
+        def bounds(self, bucket):
+                """Returns the (lower, upper) bounds of bucket, unscaled.
+                """
+                lower = bucket and 2 ** (bucket - 1) or 0
+                return float(lower) / self.scale, float(2 ** bucket) / self.scale
+
+        def percentile(self, p):
+                """Returns an estimate of the p'th percentile, the upper bound
+                of the bucket it falls in (capped at the max.)
+                """
+                if not self.count:
+                        return 0
+                wanted = self.count * p / 100.0
+                seen = 0
+                for bucket in sorted(self.buckets):
+                        seen += self.buckets[bucket]
+                        if seen >= wanted:
+                                return min(self.bounds(bucket)[1], self.max)
+                return self.max
+
+
+class SessionStats(object):
+        """Histograms of every phase and counter, over all the statements
+        recorded in a session.
+        """
+
+        def __init__(self):
+                self.reset()
+
+        def reset(self):
+                self.histograms = dict((phase, Histogram(1e6)) for phase in PHASES)
+                self.histograms.update((counter, Histogram()) for counter in COUNTERS)
+                self.errors = 0
+
+        def record(self, timer):
+                for phase, seconds in timer.times.iteritems():
+                        if seconds is not None:
+                                self.histograms[phase].add(seconds)
+                self.histograms['rows'].add(timer.rows)
+                self.histograms['bytes'].add(timer.bytes)
+                if timer.error is not None:
+                        self.errors += 1
+
+        def summary_rows(self):
+                """Returns a table of count, mean, median, p95 and max. for
+                every phase and counter, header first.
+                """
+                rows = [['Metric', 'Count', 'Mean', 'p50', 'p95', 'Max', 'Total']]
+                for name in PHASES + COUNTERS:
+                        h = self.histograms[name]
+                        fmt = formatter(name)
+                        rows.append([name, h.count, fmt(h.mean), fmt(h.percentile(50)),
+                                     fmt(h.percentile(95)), fmt(h.max or 0), fmt(h.total)])
+                return rows
+
+        def histogram_rows(self, name, width=40):
+                """Returns a table of the buckets in the histogram for name,
+                with a bar chart of their counts, header first.
+                """
+                h = self.histograms[name]
+                fmt = formatter(name)
+                rows = [['From', 'To', 'Count', '']]
+                most = max(h.buckets.values() or [0])
+                for bucket in sorted(h.buckets):
+                        lower, upper = h.bounds(bucket)
+                        count = h.buckets[bucket]
+                        rows.append([fmt(lower), fmt(upper), count, '#' * max(1, count * width // most)])
+                return rows
+
+
+def formatter(name):
+        """Returns the function used to format values of the metric name.
+        """
+        if name == 'bytes':
+                return format_bytes
+        if name in COUNTERS:
+                return format_count
+        return format_seconds
+
+
+def format_seconds(seconds):
+        if seconds < 1:
+                return '%.3f ms' % (seconds * 1000,)
+        return '%.3f s' % (seconds,)
+
+
+def format_bytes(n):
+        for unit in ('B', 'KB', 'MB'):
+                if n < 1024:
+                        return unit == 'B' and '%d B' % (n,) or '%.1f %s' % (n, unit)
+                n /= 1024.0
+        return '%.1f GB' % (n,)
+
+
+def format_count(n):
+        if isinstance(n, float) and not n.is_integer():
+                return '%.1f' % (n,)
+        return '%d' % (n,)
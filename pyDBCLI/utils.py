@@ -10,9 +10,65 @@ import sys
 import getopt
 import re
 import cmd
+import time
+import shlex
+import copy
+import types
+import glob
+import threading
+from Queue import Queue, Empty
+from itertools import islice
 from datetime import datetime, date
 
-from pyDBCLI.helpers import print_table, error
+from pyDBCLI.helpers import print_table, error, progress, memoized
+from pyDBCLI import bulk
+from pyDBCLI import registry
+from pyDBCLI.cache import MetadataCache, LRUCache, StatementCache, CachedResult, result_size
+from pyDBCLI.completion import Completer
+from pyDBCLI.jobs import QueryJob
+from pyDBCLI.pool import ConnectionPool
+from pyDBCLI.fanout import FanOut, merge, parse_order
+from pyDBCLI.columnar import ColumnStore
+from pyDBCLI.watch import ResultDiff
+from pyDBCLI.stats import QueryTimer, SessionStats, PHASES, COUNTERS, format_seconds
+from pyDBCLI.renderers import renderers, VerticalRenderer
+from pyDBCLI.sqlsplit import StatementSplitter, split, statement_kind, normalize, read_only, cacheable, bind, DDL_KEYWORDS
+
+
+# \filter arguments, column name, operator and value
+_filter_re = re.compile(r"""\s*("[^"]+"|`[^`]+`|\[[^\]]+\]|[^\s=!<>~]+)\s*"""
+                        r"""(<=|>=|<>|!=|==|=|<|>|~|\s(?:like|is\s+not|is)\s)(.*)$""", re.I | re.S)
+# Compiled special command regexes, by class and commands, see
+# Utility._dispatch_res()
+_dispatch_res = {}
+# \watch arguments, interval, key columns and query
+_watch_re = re.compile(r'^\s*(\d+(?:\.\d*)?|\.\d+)(?:\s+by\s+((?:[^\s,]+\s*,\s*)*[^\s,]+))?(.*)$', re.I | re.S)
+
+
+def unique(names):
+        """Returns names without repeats, in order.
+        """
+        seen = set()
+        return [n for n in names if not (n in seen or seen.add(n))]
+
+def literal(text):
+        """Parse a value given to a special command, e.g. \\set, NULL is
+        None, numbers are ints or floats, strings may be quoted.
+        """
+        value = text.strip()
+        if value.lower() == 'null':
+                return None
+        if value[:1] in ('"', "'") and value[-1:] == value[:1] and len(value) > 1:
+                value = value[1:-1]
+        else:
+                for number in (int, float):
+                        try:
+                                return number(value)
+                        except ValueError:
+                                pass
+        if isinstance(value, str):
+                value = value.decode('utf-8', 'replace')
+        return value
 
 
 class Utility(cmd.Cmd):
@@ -29,14 +85,80 @@ class Utility(cmd.Cmd):
         cursor = None
         # DBAPI cursor to access system, can be the same as cursor
         system_cursor = None
-        # Special d|l|c|G|x commands
-        special_cmds = ['d', 'l', 'c', 'G', 'x',]
-        # Current SQL command
-        current = ''
+        # Special \ prefixed commands, e.g. \d
+        special_cmds = ['d', 'dc', 'l', 'c', 'G', 'x', 'format', 'import', 'export', 'cache', 'bg', 'fg', 'jobs', 'kill', 'conninfo', 'fanout', 'timing', 'stats', 'sort', 'filter', 'top', 'set', 'unset', 'prepare', 'exec', 'watch', 'explain', 'analyze',]
         # Whether vertical print mode is on or not
         vertical_display = False
-        # Cache of relation data (metadata displayed by \d)
-        data_cache = {}
+        # Nr. of rows pulled from the cursor per fetchmany() call
+        fetch_size = 1000
+        # Nr. of rows used to estimate column widths when streaming results
+        sample_size = 100
+        # Name of the renderer used to output results, see \format
+        output_format = 'aligned'
+        # Nr. of rows inserted per executemany() call, and per transaction,
+        # by \import
+        import_chunk_size = 10000
+        # Nr. of rows used to infer column types by \import
+        import_sample_size = 1000
+        # DBAPI parameter placeholder, for the qmark paramstyle
+        placeholder = '?'
+        # Whether interactive queries run in a worker thread, so they can
+        # be cancelled with Ctrl-C
+        background_queries = True
+        # Seconds before a progress indicator is shown for a running query
+        progress_delay = 1.0
+        # Seconds to wait for a cancelled query to stop
+        cancel_timeout = 10
+        # Max. nr. of rows kept by each \bg job
+        bg_max_rows = 10000
+        # QueryJob for the query currently running
+        job = None
+        # Max. nr. of connections kept open for \c, and seconds after which
+        # idle ones are closed
+        pool_size = 8
+        pool_idle_timeout = 600
+        # DSN/schema currently connected to via connect()
+        current_dsn = None
+        # DSNs/files statements are run on in parallel, see \fanout
+        fanout_targets = ()
+        # Nr. of threads used for \fanout, 0 for one per CPU
+        fanout_workers = 0
+        # Whether a summary of each query's timings is printed, see \timing
+        timing = False
+        # Callables passed a dict of each query's timings and counts, see
+        # pyDBCLI.stats.QueryTimer.as_dict()
+        stats_hooks = ()
+        # Cache of relation data (metadata displayed by \d), created per
+        # instance, with a namespace per connection
+        data_cache = None
+        # Max. nr. of entries cached per connection, and how long they're
+        # kept for in seconds (None for no expiry)
+        cache_size = 256
+        cache_ttl = None
+        # Cache of read-only query results (a pyDBCLI.cache.LRUCache), off
+        # (None) unless turned on with \cache on, and its max. size in
+        # bytes
+        result_cache = None
+        result_cache_size = 64 * 1024 * 1024
+        # Max. nr. of cursors kept open per connection for re-executing
+        # parameterized statements (and statements cached by drivers that
+        # support it, e.g. sqlite3's cached_statements)
+        statement_cache_size = 100
+        # Max. nr. of rows of each result of \watch compared with the last
+        watch_max_rows = 100000
+        # Max. nr. of rows of the last result kept for \sort, \filter and
+        # \top, 0 to keep none
+        last_result_max_rows = 100000
+        # pyDBCLI.columnar.ColumnStore of the last result
+        last_result = None
+        # Last query run that returned rows, watched by \watch by default
+        last_query = None
+        # Optional pyDBCLI.catalog.CatalogStore, persisting metadata
+        # between sessions
+        catalog = None
+        # Age in seconds after which metadata read from the catalog is
+        # refreshed in the background
+        catalog_refresh_age = 3600
         # String names for DB types
         db_types = {
             str: 'text',
@@ -51,17 +173,63 @@ class Utility(cmd.Cmd):
             None: 'null',
         }
 
+        def __init__(self, *args, **kwargs):
+                cmd.Cmd.__init__(self, *args, **kwargs)
+                # Splits input into SQL statements, see default()
+                self.splitter = StatementSplitter()
+                if self.data_cache is None:
+                        self.data_cache = MetadataCache(self.cache_size, self.cache_ttl)
+                # Metadata refreshed by background threads, see metadata_miss()
+                self._refreshed = Queue()
+                # Tab completion of SQL, see completedefault()
+                self.completer = Completer()
+                self._prefetching = False
+                # Namespaces the schema model failed to load for in the
+                # background, see start_prefetch()
+                self._prefetch_failed = set()
+                # Open connections, see connect()
+                self.pool = ConnectionPool(self.pool_size, self.pool_idle_timeout)
+                # The current connection, if opened by open_connection(), see
+                # iter_query()
+                self._connection = None
+                # Cursor the last query ran on, for its rowcount, see
+                # iter_query()
+                self._query_cursor = None
+                # Queries left running with \bg, by job nr.
+                self.jobs = {}
+                self._progress_shown = False
+                # Timings of every query run, see \stats
+                self.stats = SessionStats()
+                # Bind variables, see \set, and statements, see \prepare
+                self.variables = {}
+                self.prepared = {}
+                self.statements = StatementCache(self.statement_cache_size)
+
+        @property
+        def current(self):
+                """Current incomplete SQL command.
+                """
+                return self.splitter.buffer
+
         def parseline(self, line):
                 """Overridden Cmd.parseline so we can handle
                 escaped special commands, such as \d and \G
+                Special commands are only run with a \ prefix, other lines
+                starting with their names (e.g. SET or EXPLAIN) are SQL, as
+                is every line of an incomplete statement, and are passed
+                to default() unchanged.
                 """
-                # Hack to enforce d|l|c|G are prefixed with a \
-                if re.match(self.unesc_special_cmds_re, line):
-                        line = '^%s' % (line,)
-                elif not self.current:
+                if self.splitter.pending:
+                        if line.strip() == 'EOF':
+                                return cmd.Cmd.parseline(self, line)
+                        return None, None, line
+                if self.special_cmds_re.match(line):
                         # Remove \ at the begining of a command
-                        line = re.sub(self.special_cmds_re, r'\1\2\3', line)
+                        return cmd.Cmd.parseline(self, line[1:])
                 ret = cmd.Cmd.parseline(self, line)
+                if ret[0] in self.special_cmds or ret[0] in registry.commands:
+                        # e.g. ANALYZE; rather than \analyze
+                        return None, None, line
                 return ret
 
         def emptyline(self):
@@ -103,27 +271,55 @@ class Utility(cmd.Cmd):
                 """\l
 List schemas
 """
-                if not self.current:
+                if not self.splitter.pending:
                         print_table(self.get_schemas(), self.vertical_display)
 
         def do_d(self, line):
                 """Method to handle special comand \d,
 to list tables or columnds in a table if line isn't empty.
 """
-                if not self.current:
+                if not self.splitter.pending:
                         if line.strip():
-                                print_table(self.get_columns(line), self.vertical_display)
+                                print_table(self.get_columns(line.strip()), self.vertical_display)
                         else:
                                 print_table(self.get_tables(), self.vertical_display)
 
+        def do_dc(self, line):
+                """\\dc <column>
+List the tables with a column called <column>, which may contain
+wildcards, e.g. \\dc *_id
+"""
+                if not self.splitter.pending:
+                        if not line.strip():
+                                error("Usage: \\dc <column>", False)
+                                return
+                        rows = [['Table name', 'Column name', 'Type',]]
+                        for c in self.get_schema_model().find_columns(line.strip()):
+                                rows.append([c.table, c.name, c.type])
+                        print_table(rows, self.vertical_display)
+
         def do_c(self, line):
                 """\c <schema>
 Change current connection to another template or profile.
 """
-                if not self.current and self.connect(line.strip()):
+                if not self.splitter.pending and self.connect(line.strip()):
                         print >> sys.stdout, "Connected to '%s'" % (line.strip(),)
-                        self.data_cache = {}
+                        self.completer = Completer()
+                        self.start_prefetch()
 
+        def do_conninfo(self, line):
+                """\\conninfo
+List the open connections kept for \\c, the current one marked *.
+"""
+                now = time.time()
+                rows = [['Connection', 'Opened', 'Idle',]]
+                for key, opened, used in self.pool.entries():
+                        if key == self.current_dsn:
+                                key, idle = '%s *' % (key,), '-'
+                        else:
+                                idle = '%ds' % (now - used,)
+                        rows.append([key, '%ds ago' % (now - opened,), idle])
+                print_table(rows, self.vertical_display)
 
         def do_G(self, line):
                 """\G
@@ -142,56 +338,296 @@ Alias of \G.
 """
                 return self.do_G(line)
 
+        def do_format(self, line):
+                """\\format [aligned|vertical|unaligned|csv|tsv|jsonl]
+Set the output format used for query results, or show the current
+format if none is given.
+"""
+                name = line.strip().lower()
+                if not name:
+                        print >> sys.stdout, "Output format is %s (available: %s)" % (
+                                self.output_format, ', '.join(sorted(renderers)),)
+                elif name in renderers:
+                        self.output_format = name
+                        print >> sys.stdout, "Output format is %s" % (name,)
+                else:
+                        error("Unknown output format '%s'" % (name,), False)
+
+        def do_import(self, line):
+                """\\import <file> <table>
+Bulk load a CSV or TSV file (with a header row) or JSON Lines file into
+a table, creating the table if it doesn't exist. Files ending .gz are
+decompressed on the fly.
+"""
+                if self.splitter.pending:
+                        return
+                try:
+                        path, table = shlex.split(line)
+                except ValueError:
+                        error("Usage: \\import <file> <table>", False)
+                        return
+                try:
+                        f = bulk.open_file(path)
+                except IOError, e:
+                        error(e, False)
+                        return
+                try:
+                        self.import_rows(table, *bulk.read_rows(f, bulk.file_format(path)))
+                except Exception, e:
+                        self.rollback()
+                        error(e, False)
+                finally:
+                        f.close()
+
+        def import_rows(self, table, columns, rows):
+                """Insert an iterable of rows into table, in chunks of
+                import_chunk_size rows per executemany() and transaction.
+                If the table doesn't exist it's created, with column types
+                inferred from the first import_sample_size rows.
+                Returns the nr. of rows inserted.
+                """
+                sample = list(islice(rows, self.import_sample_size))
+                if not columns:
+                        print >> sys.stdout, "Nothing to import."
+                        return 0
+                types = bulk.infer_types(columns, sample)
+                cursor = self.cursor
+                if not self.table_exists(table):
+                        cursor.execute('CREATE TABLE %s (%s)' % (
+                                self.quote_ident(table),
+                                ', '.join(['%s %s' % (self.quote_ident(c), self.db_types[t])
+                                           for (c, t) in zip(columns, types)]),))
+                        self.invalidate_metadata()
+                self.invalidate_results()
+                sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                        self.quote_ident(table),
+                        ', '.join([self.quote_ident(c) for c in columns]),
+                        ', '.join([self.placeholder] * len(columns)),)
+                convert = bulk.converters(types)
+                self.prepare_import(cursor)
+
+                rows = iter(rows)
+                chunk = sample
+                count = 0
+                started = time.time()
+                while chunk:
+                        self.insert_rows(cursor, sql, [convert(row) for row in chunk])
+                        self.commit()
+                        count += len(chunk)
+                        elapsed = time.time() - started
+                        progress("%d rows imported, %.0f rows/s" % (count, count / (elapsed or 1e-9),))
+                        chunk = list(islice(rows, self.import_chunk_size))
+                progress("%d rows imported into %s in %.2fs, %.0f rows/s" % (
+                        count, table, time.time() - started,
+                        count / ((time.time() - started) or 1e-9),), True)
+                return count
+
+        def do_export(self, line):
+                """\\export <file> <query>
+Run a query and write its results straight to a CSV, TSV or JSON Lines
+file (chosen by extension), gzip compressed if the file name ends .gz.
+"""
+                if self.splitter.pending:
+                        return
+                m = re.match(r'\s*("[^"]+"|\'[^\']+\'|\S+)\s+(.+)$', line, re.S)
+                statements = m and split(m.group(2)) or []
+                if len(statements) != 1:
+                        error("Usage: \\export <file> <query>", False)
+                        return
+                path = m.group(1).strip('\'"')
+                try:
+                        f = bulk.open_file(path, 'wb')
+                except IOError, e:
+                        error(e, False)
+                        return
+                try:
+                        self.export_query(statements[0], f, bulk.file_format(path), path)
+                except KeyboardInterrupt:
+                        self.cancel_job()
+                        print >> sys.stdout, "\nExport cancelled."
+                except Exception, e:
+                        error(e, False)
+                finally:
+                        f.close()
+
+        def export_query(self, sql, f, format='csv', name=None):
+                """Run a query and write its results to the open file f
+                using the renderer for format, reporting progress to STDERR.
+                Returns the nr. of rows written.
+                """
+                renderer = renderers[format](f)
+                renderer.flush_stream = False
+                renderer.buffer_size = 1 << 20
+                keys, batches = self.iter_query(sql)
+                if not keys:
+                        error("Query returned no result set", False)
+                        return 0
+                started = time.time()
+                state = {'count': 0}
+                def counted(batches):
+                        for batch in batches:
+                                yield batch
+                                state['count'] += len(batch)
+                                elapsed = time.time() - started
+                                progress("%d rows exported, %.0f rows/s" % (
+                                        state['count'], state['count'] / (elapsed or 1e-9),))
+                count = renderer.render(keys, counted(batches), self.sample_size)
+                if not count:
+                        renderer.render_empty(keys)
+                elapsed = time.time() - started
+                progress("%d rows exported to %s in %.2fs, %.0f rows/s" % (
+                        count, name or format, elapsed, count / (elapsed or 1e-9),), True)
+                return count
+
+        def do_bg(self, line):
+                """\\bg <query>
+Run a query in the background, on a connection of its own, keeping
+the first rows of its results to be shown by \\fg.
+"""
+                if self.splitter.pending:
+                        return
+                statements = split(line)
+                if len(statements) != 1:
+                        error("Usage: \\bg <query>", False)
+                        return
+                try:
+                        cursor = self.new_cursor()
+                except NotImplementedError:
+                        error("Background queries aren't supported by this connection", False)
+                        return
+                except Exception, e:
+                        error(e, False)
+                        return
+                nr = max(self.jobs.keys() or [0]) + 1
+                self.jobs[nr] = QueryJob(cursor, statements[0], self.fetch_size,
+                                         collect=True, max_rows=self.bg_max_rows).start()
+                print >> sys.stdout, "[%d] started" % (nr,)
+
+        def do_jobs(self, line):
+                """\\jobs
+List queries started with \\bg.
+"""
+                rows = [['Job', 'Status', 'Elapsed', 'Rows fetched', 'Query']]
+                for nr in sorted(self.jobs):
+                        job = self.jobs[nr]
+                        sql = ' '.join(job.sql.split())
+                        rows.append([nr, job.status, '%.1fs' % (job.elapsed,), job.fetched,
+                                     len(sql) > 40 and sql[:37] + '...' or sql])
+                print_table(rows, self.vertical_display)
+
+        def do_fg(self, line):
+                """\\fg [job]
+Show the results fetched so far by a \\bg query, by default the most
+recent one. Finished jobs are removed once shown.
+"""
+                nr = self._job_nr(line)
+                if nr is None:
+                        return
+                job = self.jobs[nr]
+                if job.error is not None:
+                        error(job.error, False)
+                elif job.keys:
+                        rows = job.rows[:]
+                        count = self.get_renderer().render(job.keys, [rows], self.sample_size)
+                        if not count:
+                                print >> sys.stdout, "\nNo results found."
+                        elif job.fetched > count:
+                                print >> sys.stdout, "\n%d of %d found." % (count, job.fetched,)
+                        else:
+                                print >> sys.stdout, "\n%d found." % (count,)
+                print >> sys.stdout, "[%d] %s after %.1fs" % (nr, job.status, job.elapsed,)
+                if job.done:
+                        self._remove_job(nr)
+
+        def do_kill(self, line):
+                """\\kill <job>
+Cancel a \\bg query.
+"""
+                nr = self._job_nr(line)
+                if nr is not None:
+                        self.cancel_job(self.jobs[nr])
+                        print >> sys.stdout, "[%d] %s" % (nr, self.jobs[nr].status,)
+                        self._remove_job(nr)
+
+        def _job_nr(self, line):
+                try:
+                        nr = int(line.strip() or max(self.jobs.keys() or [0]))
+                except ValueError:
+                        nr = None
+                if nr not in self.jobs:
+                        error("No such job", False)
+                        return None
+                return nr
+
+        def _remove_job(self, nr):
+                job = self.jobs.pop(nr)
+                try:
+                        job.cursor.connection.close()
+                except Exception:
+                        pass
+
+        def prepare_import(self, cursor):
+                """Hook to set up cursor for bulk inserts, before \\import.
+                """
+                pass
+
+        def insert_rows(self, cursor, sql, rows):
+                """Insert a chunk of rows with a parameterised INSERT.
+                """
+                cursor.executemany(sql, rows)
+
+        def table_exists(self, table):
+                """Helper method to check whether a table exists, this
+                generic version just tries to select from it.
+                """
+                try:
+                        self.cursor.execute('SELECT * FROM %s WHERE 1=0' % (self.quote_ident(table),))
+                        self.cursor.fetchall()
+                except Exception:
+                        return False
+                return True
+
+        def quote_ident(self, name):
+                """Quote a table or column name for use in SQL.
+                """
+                return '"%s"' % (name.replace('"', '""'),)
+
+        def get_renderer(self, stream=None):
+                """Returns a renderer instance for the current output format,
+                vertical display mode applies to the aligned format.
+                """
+                if self.vertical_display and self.output_format == 'aligned':
+                        return VerticalRenderer(stream)
+                return renderers[self.output_format](stream)
+
         def default(self, line):
                 """Method to handle unhandled comands, will treat
-                line as SQL. If the escape character ';' is not present,
-                line is appended to self.current and not run until the
-                character is present.
+                line as SQL. Lines are fed to self.splitter and each
+                statement is run as soon as its terminating ';' is seen,
+                incomplete statements are buffered until then.
                 """
                 # Handle control char ^D as an exit command
-                if self.current == '' and line.rstrip() == '\x04':
+                if not self.splitter.pending and line.rstrip() == '\x04':
                         self.do_exit(None)
 
                 # Handle query buffer reset
                 if line.rstrip().endswith(r'\r'):
-                        self.current = ''
-                        self.prompt = self._prompt
+                        self.splitter.reset()
                         print >> sys.stdout, "Query buffer reset (cleared)."
                 else:
-                        self.current = '%s %s' % (self.current, line,)
-
-                        if ';' in self.current:
-                                first = True
-                                data = []
-                                for row in self.get_query(self.current):
-                                        if first:
-                                                keys = getattr(row, 'keys', None)
-                                                if not keys:
-                                                        # If this DBAPI doesn't provide a keys(), then
-                                                        # try cursor.description
-                                                        keys = []
-                                                        if hasattr(row, 'cursor'):
-                                                                description = getattr(row, 'cursor').description
-                                                        else:
-                                                                description = getattr(row, 'cursor_description')
-                                                        for r in description:
-                                                                keys.append(r[0])
-                                                else:
-                                                        keys = keys()
-                                                data.append(keys)
-                                                first = False
-                                        data.append([v for v in row])
-                                if len(data) > 1:
-                                        print_table(data, self.vertical_display)
-                                        print >> sys.stdout, "\n%d found." % (len(data)-1,)
-                                else:
-                                        print >> sys.stdout, "\nNo results found."
-                                self.current = ''
-                                if self.prompt == self.multi_prompt:
-                                        self.prompt = self._prompt
-                        else:
+                        started = time.time()
+                        statements = self.splitter.feed(line + '\n')
+                        if statements:
+                                parse_time = (time.time() - started) / len(statements)
+                        for statement in statements:
+                                self.run_query(statement, parse_time=parse_time)
+
+                if self.splitter.pending:
+                        if self.prompt != self.multi_prompt:
                                 self._prompt = self.prompt
                                 self.prompt = self.multi_prompt
+                elif self.prompt == self.multi_prompt:
+                        self.prompt = self._prompt
 
         def do_EOF(self, line):
                 print >> sys.stdout, "\n%s\n" % (self.outro,)
@@ -205,11 +641,64 @@ Does what it says on the tin.
 
         def do_clear(self, line):
                 """clear
-Clear cache of profiles, templates, tables and table columns.
+Clear cache of profiles, templates, tables and table columns
+for the current connection.
 """
-                self.data_cache = {}
+                self.data_cache.clear()
+                if self.catalog is not None:
+                        self.catalog.clear(self.catalog_namespace)
                 print >> sys.stdout, "Cache cleared."
 
+        def do_cache(self, line):
+                """\\cache [on|off|clear]
+Turn caching of read-only query results on or off, or clear it. With no
+arguments, show metadata cache statistics for each connection, and for
+the result cache if it's on.
+"""
+                if self.splitter.pending:
+                        return
+                arg = line.strip().lower()
+                if arg == 'on':
+                        if self.result_cache is None:
+                                self.result_cache = LRUCache(sys.maxint, None, self.result_cache_size,
+                                                             lambda result: result.size)
+                        print >> sys.stdout, "Result cache ON (max. %.1f MB)" % (self.result_cache_size / 1048576.0,)
+                        return
+                elif arg == 'off':
+                        self.result_cache = None
+                        print >> sys.stdout, "Result cache OFF"
+                        return
+                elif arg == 'clear':
+                        self.invalidate_results()
+                        print >> sys.stdout, "Result cache cleared."
+                        return
+                elif arg:
+                        error("Usage: \\cache [on|off|clear]", False)
+                        return
+
+                rows = [['Connection', 'Entries', 'Hits', 'Misses', 'Hit rate', 'Evictions']]
+                if hasattr(self.data_cache, 'stats'):
+                        for namespace, stats in self.data_cache.stats():
+                                if namespace is None and not stats['hits'] + stats['misses']:
+                                        continue
+                                if namespace == self.metadata_namespace:
+                                        namespace = '%s *' % (namespace,)
+                                rows.append([namespace, stats['entries'], stats['hits'], stats['misses'],
+                                             '%.1f%%' % (stats['hit_rate'] * 100,), stats['evictions']])
+                else:
+                        # A plain dict, with no stats of its own
+                        rows.append(['%s *' % (self.metadata_namespace,), len(self.data_cache), '', '', '', ''])
+                if self.result_cache is not None:
+                        stats = self.result_cache.stats()
+                        rows.append(['Query results (%.1f MB)' % (stats['weight'] / 1048576.0,),
+                                     stats['entries'], stats['hits'], stats['misses'],
+                                     '%.1f%%' % (stats['hit_rate'] * 100,), stats['evictions']])
+                stats = self.statements.stats()
+                if stats['hits'] + stats['misses']:
+                        rows.append(['Prepared statements', stats['entries'], stats['hits'], stats['misses'],
+                                     '%.1f%%' % (stats['hit_rate'] * 100,), stats['evictions']])
+                print_table(rows, self.vertical_display)
+
         def get_query(self, sql):
                 """Helper method to get results for an SQL
                 query, via the internal DBAPI cursor.
@@ -221,6 +710,1081 @@ Clear cache of profiles, templates, tables and table columns.
                         error(e, False)
                 return data
 
+        def iter_query(self, sql, background=None, params=None):
+                """Helper method to execute an SQL query via the internal
+                DBAPI cursor, returning a tuple of the column names and an
+                iterator of row batches (as per cursor.fetchmany()).
+                Column names are None if the query returns no rows, e.g. an
+                UPDATE.
+                If background (by default background_queries) is True the
+                query runs in a worker thread, see run_job(), unless the
+                cursor isn't on a connection from open_connection() (e.g.
+                one set up by a subclass itself, which may not be usable
+                from other threads).
+                If params are given the query is run with them, on a cursor
+                from statement_cursor().
+                """
+                if background is None:
+                        background = self.background_queries
+                cursor = self.cursor
+                if params is not None:
+                        cursor = self.statement_cursor(sql)
+                if background and getattr(cursor, 'connection', None) is not self._connection:
+                        background = False
+                self._query_cursor = cursor
+                if background:
+                        return self.run_job(QueryJob(cursor, sql, self.fetch_size, params=params))
+                if params is None:
+                        cursor = cursor.execute(sql) or cursor
+                else:
+                        cursor = cursor.execute(sql, params) or cursor
+                self._query_cursor = cursor
+                if not cursor.description:
+                        return None, iter(())
+                keys = [d[0] for d in cursor.description]
+                return keys, self.iter_batches(cursor)
+
+        def do_set(self, line):
+                """\\set [<name> [<value>]]
+Set a variable, which can be used in SQL as :name and is sent to the
+database as a bound parameter rather than in the SQL text. Values can be
+numbers, NULL or (quoted) strings. With no arguments, lists variables.
+"""
+                if self.splitter.pending:
+                        return
+                parts = line.strip().split(None, 1)
+                if not parts:
+                        rows = [['Name', 'Value']]
+                        rows.extend([name, repr(value)] for (name, value) in sorted(self.variables.items()))
+                        print_table(rows, self.vertical_display)
+                        return
+                if not re.match(r'^[A-Za-z_][A-Za-z_0-9]*$', parts[0]):
+                        error("Invalid variable name %s" % (parts[0],), False)
+                        return
+                if len(parts) > 1:
+                        self.variables[parts[0]] = literal(parts[1])
+                else:
+                        self.variables[parts[0]] = ''
+
+        def do_unset(self, line):
+                """\\unset <name>
+Remove a variable set with \\set.
+"""
+                if self.splitter.pending:
+                        return
+                name = line.strip()
+                if name not in self.variables:
+                        error("Variable %s is not set" % (name,), False)
+                        return
+                del self.variables[name]
+
+        def do_prepare(self, line):
+                """\\prepare <name> <query>
+Prepare a parameterized query, with ? or :name placeholders, to run with
+\\exec <name>. With no arguments, lists prepared queries.
+"""
+                if self.splitter.pending:
+                        return
+                parts = line.strip().split(None, 1)
+                if not parts:
+                        rows = [['Name', 'Parameters', 'Query']]
+                        for name, sql in sorted(self.prepared.items()):
+                                params = unique(bind(sql)[1]) or ['?'] * sql.count('?')
+                                rows.append([name, ', '.join(params), sql])
+                        print_table(rows, self.vertical_display)
+                        return
+                statements = len(parts) > 1 and split(parts[1]) or []
+                if len(statements) != 1:
+                        error("Usage: \\prepare <name> <query>", False)
+                        return
+                self.prepared[parts[0]] = statements[0]
+
+        def do_exec(self, line):
+                """\\exec <name> [<value> ...|@<file>]
+Run a query prepared with \\prepare, binding the values to its
+placeholders in order (:name placeholders not given a value use the
+variable of that name, see \\set). With @<file>, runs it once per row of
+a CSV, TSV or JSON Lines file (with a header row) with executemany().
+"""
+                if self.splitter.pending:
+                        return
+                try:
+                        args = shlex.split(line)
+                except ValueError, e:
+                        error(e, False)
+                        return
+                if not args or args[0] not in self.prepared:
+                        error(args and "No prepared query %s" % (args[0],) or "Usage: \\exec <name> [<value> ...|@<file>]", False)
+                        return
+                sql, names = bind(self.prepared[args[0]], None, self.placeholder)
+                values = args[1:]
+                if len(values) == 1 and values[0].startswith('@'):
+                        try:
+                                self.exec_file(sql, names, values[0][1:])
+                        except KeyboardInterrupt:
+                                self.rollback()
+                                print >> sys.stdout, "\nCancelled."
+                        except Exception, e:
+                                self.rollback()
+                                error(e, False)
+                        return
+                values = [literal(v) for v in values]
+                if names:
+                        params = dict(self.variables)
+                        params.update(zip(unique(names), values))
+                        missing = [n for n in unique(names) if n not in params]
+                        if missing:
+                                error("No value for %s" % (', '.join(missing),), False)
+                                return
+                        values = [params[n] for n in names]
+                self.run_query(sql, params=values)
+
+        def exec_file(self, sql, names, path):
+                """Run the parameterized sql once per row of the file at path,
+                in chunks of import_chunk_size rows per executemany() and
+                transaction. Rows are matched to names by the file's column
+                names if there are any, otherwise by position.
+                Returns the nr. of rows run.
+                """
+                f = bulk.open_file(path)
+                try:
+                        columns, rows = bulk.read_rows(f, bulk.file_format(path))
+                        if names:
+                                lowered = [c.lower() for c in columns]
+                                missing = [n for n in unique(names) if n.lower() not in lowered]
+                                if missing:
+                                        raise ValueError("No column for %s in %s" % (', '.join(missing), path,))
+                                positions = [lowered.index(n.lower()) for n in names]
+                        else:
+                                positions = range(len(columns))
+                        sample = list(islice(rows, self.import_sample_size))
+                        convert = bulk.converters(bulk.infer_types(columns, sample))
+                        self.invalidate_results()
+                        cursor = self.statement_cursor(sql)
+                        self.prepare_import(cursor)
+                        rows = iter(rows)
+                        chunk = sample
+                        count = 0
+                        started = time.time()
+                        while chunk:
+                                params = []
+                                for row in chunk:
+                                        row = convert(row)
+                                        params.append([row[i] for i in positions])
+                                self.insert_rows(cursor, sql, params)
+                                self.commit()
+                                count += len(chunk)
+                                elapsed = time.time() - started
+                                progress("%d rows run, %.0f rows/s" % (count, count / (elapsed or 1e-9),))
+                                chunk = list(islice(rows, self.import_chunk_size))
+                finally:
+                        f.close()
+                if statement_kind(sql) in DDL_KEYWORDS:
+                        self.invalidate_metadata()
+                progress("%d rows from %s run in %.2fs" % (count, path, time.time() - started,), True)
+                print >> sys.stdout, "Ran %d times." % (count,)
+                return count
+
+        def statement_cursor(self, sql):
+                """Returns a cursor on the current connection for running the
+                parameterized statement sql, reused for repeated executions
+                (so drivers can skip re-preparing it) via a StatementCache.
+                """
+                connection = getattr(self.cursor, 'connection', None)
+                if connection is None:
+                        return self.cursor
+                return self.statements.cursor(connection, sql)
+
+        def do_sort(self, line):
+                """\\sort <column> [asc|desc][, <column> [asc|desc] ...]
+Re-order the rows of the last result, without re-running the query.
+Columns can be given by name or position (from 1).
+"""
+                if self.splitter.pending or not self.has_last_result():
+                        return
+                terms = [t.split() for t in line.split(',') if t.strip()]
+                terms = [t[:1] + [d.lower() for d in t[1:]] for t in terms]
+                if not terms or [t for t in terms if len(t) > 2 or t[1:] not in ([], ['asc'], ['desc'])]:
+                        error("Usage: \\sort <column> [asc|desc][, ...]", False)
+                        return
+                try:
+                        # Sorts are stable, so sort by the last column first
+                        for term in reversed(terms):
+                                self.last_result.sort(term[0], term[1:] == ['desc'])
+                except KeyError, e:
+                        error("No such column %s" % (e.args[0],), False)
+                        return
+                self.render_last_result()
+
+        def do_filter(self, line):
+                """\\filter [<column> <op> <value>]
+Narrow the rows of the last result to those where column compares to
+value, without re-running the query. op is one of =, !=, <, <=, >, >=,
+like, ~ (regular expression), is or is not (with null). Filters add up,
+\\filter on its own shows every row again, in the original order.
+"""
+                if self.splitter.pending or not self.has_last_result():
+                        return
+                store = self.last_result
+                if not line.strip():
+                        store.reset()
+                        self.render_last_result()
+                        return
+                m = _filter_re.match(line)
+                if not m:
+                        error("Usage: \\filter <column> <op> <value>", False)
+                        return
+                name, op, value = m.group(1), ' '.join(m.group(2).lower().split()), literal(m.group(3))
+                try:
+                        store.filter(name, op, value)
+                except KeyError, e:
+                        error("No such column %s" % (e.args[0],), False)
+                        return
+                except (ValueError, re.error), e:
+                        error(e, False)
+                        return
+                self.render_last_result()
+
+        def do_top(self, line):
+                """\\top <n>
+Show the first n rows of the last result, as sorted and filtered by
+\\sort and \\filter, without re-running the query.
+"""
+                if self.splitter.pending or not self.has_last_result():
+                        return
+                try:
+                        limit = int(line.strip() or 10)
+                        if limit < 0:
+                                raise ValueError(limit)
+                except ValueError:
+                        error("Usage: \\top <n>", False)
+                        return
+                self.render_last_result(limit)
+
+        def has_last_result(self):
+                if self.last_result is None:
+                        error("No result to work on, run a query first", False)
+                        return False
+                return True
+
+        def render_last_result(self, limit=None):
+                """Render the rows of the last result's view, up to limit.
+                """
+                store = self.last_result
+                renderer = self.get_renderer()
+                count = renderer.render(store.keys, store.rows(limit, self.fetch_size), self.sample_size)
+                if not count:
+                        renderer.render_empty(store.keys)
+                if renderer.footer:
+                        print >> sys.stdout, "\n%d of %d rows%s." % (
+                                count, len(store), store.truncated and ' kept' or '',)
+
+        def iter_cached(self, sql, background=None, params=None):
+                """As iter_query(), but through result_cache if it's on and
+                sql is cacheable, returning a tuple of the column names, an
+                iterator of row batches and whether they came from the cache.
+                Results are cached once they've been read in full, unless
+                they're bigger than result_cache_size, and are only reused
+                while data_version() is unchanged.
+                """
+                if self.result_cache is None or not cacheable(sql):
+                        keys, batches = self.iter_query(sql, background, params)
+                        return keys, batches, False
+                cache = self.result_cache
+                key = (self.metadata_namespace, normalize(sql), params and tuple(params))
+                version = self.data_version()
+                result = cache.peek(key)
+                if result is not None and result.version != version:
+                        del cache[key]
+                result = cache.get(key)
+                if result is not None:
+                        rows, size = result.rows, self.fetch_size
+                        return result.keys, (rows[i:i + size] for i in xrange(0, len(rows), size)), True
+
+                keys, batches = self.iter_query(sql, background, params)
+                if not keys:
+                        return keys, batches, False
+                def caching(batches):
+                        rows = []
+                        size = 0
+                        for batch in batches:
+                                if rows is not None:
+                                        rows.extend(batch)
+                                        size += result_size(batch)
+                                        if size > self.result_cache_size:
+                                                rows = None
+                                yield batch
+                        if rows is not None:
+                                cache[key] = CachedResult(keys, rows, version, size)
+                return keys, caching(batches), False
+
+        def invalidate_results(self):
+                """Throw away cached query results, e.g. after a write.
+                """
+                if self.result_cache is not None:
+                        self.result_cache.clear()
+
+        def data_version(self):
+                """Helper method to return a value that changes whenever the
+                database is changed by another connection (e.g. SQLite's
+                PRAGMA data_version), so cached query results can be checked,
+                or None if the database can't tell.
+                """
+                return None
+
+        def iter_batches(self, cursor):
+                """Generator yielding batches of at most fetch_size rows
+                from cursor until it's exhausted.
+                """
+                while True:
+                        batch = cursor.fetchmany(self.fetch_size)
+                        if not batch:
+                                break
+                        yield batch
+
+        def run_job(self, job):
+                """Start a QueryJob and supervise it from the main thread,
+                showing elapsed time and rows fetched on STDERR while waiting.
+                Returns a tuple of the column names and an iterator of row
+                batches, as per iter_query(). A KeyboardInterrupt while
+                waiting (or reading batches) should be handled by calling
+                cancel_job().
+                """
+                self.job = job.start()
+                while not job.wait(0.2):
+                        self.show_progress(job)
+                self.clear_progress()
+                if job.keys is None:
+                        job.join()
+                        if job.error is not None:
+                                raise job.error
+                        return None, iter(())
+                def supervised():
+                        for batch in job.batches(0.2, lambda: self.show_progress(job)):
+                                self.clear_progress()
+                                yield batch
+                        self.clear_progress()
+                return job.keys, supervised()
+
+        def cancel_job(self, job=None):
+                """Cancel a running QueryJob, by default the current one,
+                via the driver's cancel_query() and wait for it to stop.
+                """
+                job = job or self.job
+                self.clear_progress()
+                if job is None or job.done:
+                        return
+                job.cancel(self.cancel_query)
+                if not job.join(self.cancel_timeout):
+                        error("Query didn't stop after %ds, the connection may still be busy" % (
+                                self.cancel_timeout,), False)
+
+        def cancel_query(self, cursor):
+                """Abort the statement running on cursor, from another
+                thread, by default using cursor.cancel() if there is one.
+                """
+                cancel = getattr(cursor, 'cancel', None)
+                if cancel is not None:
+                        cancel()
+
+        def show_progress(self, job):
+                if job.elapsed >= self.progress_delay and sys.stderr.isatty():
+                        progress("%.1fs elapsed, %d rows fetched (Ctrl-C to cancel)" % (
+                                job.elapsed, job.fetched,))
+                        self._progress_shown = True
+
+        def clear_progress(self):
+                if self._progress_shown:
+                        sys.stderr.write('\r%s\r' % (' ' * 60,))
+                        sys.stderr.flush()
+                        self._progress_shown = False
+
+        def run_query(self, sql, background=None, parse_time=0.0, params=None):
+                """Execute an SQL query and stream the results to STDOUT,
+                a batch at a time. Ctrl-C cancels the query.
+                Returns the nr. of rows output (or affected, for statements
+                that don't return rows), or None if the query failed.
+                Each phase of running the query is timed, see record_stats().
+                Unless params are given, :name references to variables set
+                with \\set are sent as parameters, see bind().
+                """
+                query = sql
+                if params is None:
+                        sql, params = self.bind_variables(sql)
+                timer = QueryTimer(sql, parse_time)
+                renderer = self.get_renderer()
+                cached = False
+                if not read_only(sql):
+                        self.invalidate_results()
+                try:
+                        if self.fanout_targets:
+                                keys, batches = self.iter_fanout(sql, params)
+                        else:
+                                keys, batches, cached = self.iter_cached(sql, background, params)
+                        timer.lap('execute')
+                        count = 0
+                        if keys:
+                                batches = timer.batches(batches)
+                                store = None
+                                if self.last_result_max_rows:
+                                        # Kept for \sort, \filter and \top
+                                        self.last_result = None
+                                        store = ColumnStore(keys, self.last_result_max_rows)
+                                        batches = store.collect(batches)
+                                count = renderer.render(keys, batches, self.sample_size)
+                                self.last_result = store
+                                self.last_query = query
+                except KeyboardInterrupt:
+                        self.cancel_job()
+                        print >> sys.stdout, "\nQuery cancelled."
+                        self.record_stats(timer.finish(0, renderer.bytes_written, 'cancelled'))
+                        return None
+                except Exception, e:
+                        # e.g. EPIPE while rendering, don't leave the worker
+                        # waiting to hand over its next batch
+                        self.cancel_job()
+                        error(e, False)
+                        self.record_stats(timer.finish(0, renderer.bytes_written, e))
+                        return None
+                timer.finish(count, renderer.bytes_written)
+                if statement_kind(sql) in DDL_KEYWORDS:
+                        self.invalidate_metadata()
+                if renderer.footer:
+                        if count:
+                                print >> sys.stdout, "\n%d found.%s" % (count, cached and ' (cached)' or '',)
+                        else:
+                                print >> sys.stdout, "\nNo results found."
+                self.record_stats(timer)
+                if not keys:
+                        if self.fanout_targets:
+                                return self.job.rowcount
+                        # Parameterized statements run on a cursor of their
+                        # own, see statement_cursor()
+                        return max(getattr(self._query_cursor or self.cursor, 'rowcount', 0), 0)
+                return count
+
+        def bind_variables(self, sql):
+                """Returns sql with :name references to variables set with
+                \\set replaced by placeholders, and a list of their values
+                (None if there are none), see bind().
+                """
+                if self.variables:
+                        bound, names = bind(sql, self.variables, self.placeholder)
+                        if names:
+                                return bound, [self.variables[name] for name in names]
+                return sql, None
+
+        def do_watch(self, line):
+                """\\watch <seconds> [by <column>[,<column> ...]] [<query>]
+Re-run a query (by default the last one that returned rows) every so many
+seconds until Ctrl-C, showing only the rows added (+), removed (-) or
+changed (~) since the last run, with the change in numeric columns.
+Rows are matched by the given key columns, otherwise by all their values.
+"""
+                if self.splitter.pending:
+                        return
+                m = _watch_re.match(line)
+                if not m:
+                        error("Usage: \\watch <seconds> [by <column>[,<column> ...]] [<query>]", False)
+                        return
+                interval = float(m.group(1))
+                key_columns = [c.strip() for c in (m.group(2) or '').split(',') if c.strip()]
+                sql = m.group(3).strip().rstrip(';') or self.last_query
+                if not sql:
+                        error("No query to watch, run one first", False)
+                        return
+                if len(split(sql)) != 1:
+                        error("Only a single query can be watched", False)
+                        return
+                diff = None
+                try:
+                        while True:
+                                started = time.time()
+                                diff = self.watch_query(sql, key_columns, diff, interval)
+                                if diff is None:
+                                        return
+                                time.sleep(max(interval - (time.time() - started), 0))
+                except KeyboardInterrupt:
+                        self.cancel_job()
+                        print >> sys.stdout, "\nWatch stopped."
+
+        def watch_query(self, sql, key_columns, diff=None, interval=0):
+                """Run sql for \\watch, rendering the whole result the first
+                time (when diff is None) and only the changes since the last
+                time after that, streaming rows through a
+                pyDBCLI.watch.ResultDiff. Returns the ResultDiff to pass in
+                next time, or None if the query failed.
+                """
+                sql, params = self.bind_variables(sql)
+                timer = QueryTimer(sql)
+                renderer = self.get_renderer()
+                count = 0
+                try:
+                        if self.fanout_targets:
+                                keys, batches = self.iter_fanout(sql, params)
+                        else:
+                                keys, batches = self.iter_query(sql, params=params)
+                        timer.lap('execute')
+                        if not keys:
+                                error("Query returned no rows to watch", False)
+                                return None
+                        batches = timer.batches(batches)
+                        stamp = time.strftime('%H:%M:%S')
+                        if diff is None or diff.keys != list(keys):
+                                diff = ResultDiff(keys, key_columns, self.watch_max_rows)
+                                print >> sys.stdout, "Every %gs: %s\n" % (interval, stamp,)
+                                count = renderer.render(keys, diff.track(batches), self.sample_size)
+                                if renderer.footer:
+                                        print >> sys.stdout, "\n%d found." % (count,)
+                        else:
+                                count = renderer.render([''] + list(keys), diff.diff(batches, self.fetch_size),
+                                                        self.sample_size)
+                                if count and renderer.footer:
+                                        print >> sys.stdout
+                                print >> sys.stdout, "%s: %d rows, %d added, %d removed, %d changed%s." % (
+                                        stamp, diff.count, diff.added, diff.removed, diff.changed,
+                                        diff.truncated and ' (first %d compared)' % (diff.max_rows,) or '',)
+                except KeyError, e:
+                        self.cancel_job()
+                        error("No such column %s" % (e.args[0],), False)
+                        self.record_stats(timer.finish(0, renderer.bytes_written, e))
+                        return None
+                except KeyboardInterrupt:
+                        self.record_stats(timer.finish(count, renderer.bytes_written, 'cancelled'))
+                        raise
+                except Exception, e:
+                        # e.g. EPIPE while rendering, don't leave the worker
+                        # waiting to hand over its next batch
+                        self.cancel_job()
+                        error(e, False)
+                        self.record_stats(timer.finish(0, renderer.bytes_written, e))
+                        return None
+                self.record_stats(timer.finish(diff.count, renderer.bytes_written))
+                return diff
+
+        def do_explain(self, line):
+                """\\explain <query>
+Show the plan for a query as a tree, without running it, flagging full
+table scans, temp. b-trees and other costly steps. Without the \\, EXPLAIN
+is sent to the database as SQL.
+"""
+                if self.splitter.pending:
+                        return
+                sql = self.single_statement(line, "Usage: \\explain <query>")
+                if sql is not None:
+                        self.show_plan(*self.bind_variables(sql))
+
+        def do_analyze(self, line):
+                """\\analyze [test] <query>
+As \\explain, then run the query (discarding its rows) to time it, and
+suggest indexes for the tables it scans. With test, each suggested index
+is built on a separate connection, the query timed with it, then rolled
+back, to measure the speedup. Statements that change data aren't run.
+Without the \\, ANALYZE is sent to the database as SQL.
+"""
+                if self.splitter.pending:
+                        return
+                parts = line.split(None, 1)
+                test = parts[:1] == ['test']
+                if test:
+                        line = ''.join(parts[1:])
+                sql = self.single_statement(line, "Usage: \\analyze [test] <query>")
+                if sql is None:
+                        return
+                sql, params = self.bind_variables(sql)
+                nodes = self.show_plan(sql, params)
+                if nodes is None:
+                        return
+                # Statements that change data are only explained, timing
+                # them (or testing indexes with them) would apply them
+                if not read_only(sql):
+                        print >> sys.stdout, "Not run, as it changes data."
+                        test = False
+                else:
+                        started = time.time()
+                        count = 0
+                        try:
+                                keys, batches = self.iter_query(sql, params=params)
+                                for batch in batches:
+                                        count += len(batch)
+                        except KeyboardInterrupt:
+                                self.cancel_job()
+                                print >> sys.stdout, "\nQuery cancelled."
+                                return
+                        except Exception, e:
+                                error(e, False)
+                                return
+                        print >> sys.stdout, "Time: %s, %d rows" % (format_seconds(time.time() - started), count,)
+
+                from pyDBCLI.explain import scanned_tables, suggest_indexes
+                model = self.get_schema_model()
+                suggestions = suggest_indexes(sql, scanned_tables(nodes),
+                                              lambda table: [c.name for c in model.columns(table)])
+                if not suggestions:
+                        return
+                rows = [['Suggested index', 'Before', 'With index', 'Speedup']]
+                for table, columns in suggestions:
+                        create = self.index_sql(table, columns)
+                        row = [create, '', '', '']
+                        if test:
+                                try:
+                                        before, after = self.test_index(sql, params, create)
+                                        row[1:] = [format_seconds(before), format_seconds(after),
+                                                   '%.1fx' % (before / (after or 1e-9),)]
+                                except NotImplementedError:
+                                        row[3] = 'not supported'
+                                except KeyboardInterrupt:
+                                        print >> sys.stdout, "\nCancelled."
+                                        break
+                                except Exception, e:
+                                        row[3] = str(e)
+                        rows.append(row)
+                print_table(rows, self.vertical_display)
+
+        def single_statement(self, line, usage):
+                """Returns the single statement in line, or None (after
+                reporting an error) if there isn't exactly one.
+                """
+                statements = split(line)
+                if len(statements) != 1:
+                        error(usage, False)
+                        return None
+                return statements[0]
+
+        def show_plan(self, sql, params=None):
+                """Print the plan for sql as a tree, with plan_stats(),
+                returning its PlanNodes, or None if it couldn't be fetched.
+                """
+                try:
+                        nodes = self.get_plan(sql, params)
+                        stats = self.plan_stats(sql, params)
+                except NotImplementedError:
+                        error("Query plans aren't supported for this database", False)
+                        return None
+                except Exception, e:
+                        error(e, False)
+                        return None
+                if nodes:
+                        from pyDBCLI.explain import plan_rows
+                        print_table(plan_rows(nodes), self.vertical_display)
+                for name, value in stats:
+                        print >> sys.stdout, "%s: %s" % (name, value)
+                return nodes
+
+        def get_plan(self, sql, params=None):
+                """Returns the plan for sql as a list of
+                pyDBCLI.explain.PlanNodes. This generic version runs
+                EXPLAIN <sql>, taking each row as a step (as key=value
+                pairs if it has several columns) nested by indentation, as
+                PostgreSQL's plans are.
+                """
+                sql = 'EXPLAIN %s' % (sql,)
+                if params is None:
+                        cursor = self.cursor.execute(sql) or self.cursor
+                else:
+                        cursor = self.cursor.execute(sql, params) or self.cursor
+                names = [d[0] for d in cursor.description or ()]
+                lines = []
+                for row in cursor.fetchall():
+                        if len(row) == 1:
+                                lines.append(unicode(row[0]))
+                        else:
+                                lines.append(' '.join('%s=%s' % (k, v) for (k, v) in zip(names, row)
+                                                      if v is not None))
+                from pyDBCLI.explain import indented_plan
+                return indented_plan(lines)
+
+        def plan_stats(self, sql, params=None):
+                """Hook returning a list of (name, value) statistics about
+                the plan for sql, e.g. its size. None by default.
+                """
+                return []
+
+        def index_sql(self, table, columns):
+                """Returns a CREATE INDEX statement for columns of table.
+                """
+                name = re.sub(r'\W+', '_', 'idx_%s_%s' % (table, '_'.join(columns))).lower()
+                return 'CREATE INDEX %s ON %s (%s)' % (
+                        self.quote_ident(name), self.quote_ident(table),
+                        ', '.join([self.quote_ident(c) for c in columns]),)
+
+        def test_index(self, sql, params, create):
+                """Hook returning a tuple of how long sql takes (in seconds)
+                without and with the index created by the create statement,
+                without leaving the index in place. Optional, raises
+                NotImplementedError if not supported.
+                """
+                raise NotImplementedError
+
+        def record_stats(self, timer):
+                """Add a finished QueryTimer to the session stats, print its
+                summary if \\timing is on, and pass its metrics to each of
+                stats_hooks.
+                """
+                self.stats.record(timer)
+                if self.timing:
+                        print >> sys.stdout, timer.summary()
+                if self.stats_hooks:
+                        metrics = timer.as_dict()
+                        for hook in self.stats_hooks:
+                                try:
+                                        hook(dict(metrics))
+                                except Exception, e:
+                                        error("Stats hook failed: %s" % (e,), False)
+
+        def do_timing(self, line):
+                """\\timing [on|off]
+Toggle printing how long each query took, split into parse, execute,
+fetch and render time, with the nr. of rows and bytes output.
+"""
+                if self.splitter.pending:
+                        return
+                arg = line.strip().lower()
+                if arg:
+                        self.timing = arg == 'on'
+                else:
+                        self.timing = not self.timing
+                print >> sys.stdout, "Timing is %s." % (self.timing and 'on' or 'off',)
+
+        def do_stats(self, line):
+                """\\stats [<metric>|reset]
+Show a summary of the timings of every query run this session, or a
+histogram of one metric (e.g. execute, fetch, rows), or reset them.
+"""
+                if self.splitter.pending:
+                        return
+                name = line.strip().lower()
+                if name == 'reset':
+                        self.stats.reset()
+                        print >> sys.stdout, "Statistics reset."
+                elif not name:
+                        print_table(self.stats.summary_rows(), self.vertical_display)
+                elif name in self.stats.histograms:
+                        print_table(self.stats.histogram_rows(name), self.vertical_display)
+                else:
+                        error("Unknown metric %s, expected one of: %s" % (
+                                name, ', '.join(PHASES + COUNTERS),), False)
+
+        def iter_fanout(self, sql, params=None):
+                """Run sql on every one of fanout_targets in parallel, see
+                pyDBCLI.fanout, returning a tuple of the column names (with
+                a source column first) and an iterator of merged row batches.
+                A simple trailing ORDER BY and/or LIMIT is applied to the
+                merged rows. Errors are reported per target.
+                """
+                workers = self.fanout_workers
+                if not workers:
+                        # Only needed for this, and slow to import
+                        import multiprocessing
+                        workers = multiprocessing.cpu_count()
+                fan = self.job = FanOut(self.fanout_targets, sql, self.open_connection,
+                                        workers, self.fetch_size, params).start()
+                def results():
+                        for item in fan.results():
+                                yield item
+                        for target, e in fan.errors:
+                                error("%s: %s" % (target, e), False)
+                terms, limit = parse_order(sql)
+                keys, batches = merge(results(), terms, limit, self.fanout_targets)
+                if keys is None:
+                        return None, iter(())
+                return keys, batches
+
+        def do_fanout(self, line):
+                """\\fanout [<target> ...|off]
+Run statements on every target (e.g. SQLite files, globs are expanded)
+in parallel, merging the results with a source column, or turn fan-out
+off. With no arguments, lists the current targets.
+"""
+                if self.splitter.pending:
+                        return
+                try:
+                        args = shlex.split(line)
+                except ValueError, e:
+                        error(e, False)
+                        return
+                if args == ['off']:
+                        self.fanout_targets = []
+                        print >> sys.stdout, "Fan-out OFF"
+                elif args:
+                        self.fanout_targets = self.expand_targets(args)
+                        print >> sys.stdout, "Fan-out over %d targets" % (len(self.fanout_targets),)
+                elif self.fanout_targets:
+                        print_table([['Target']] + [[t] for t in self.fanout_targets], self.vertical_display)
+                else:
+                        print >> sys.stdout, "Fan-out OFF"
+
+        def expand_targets(self, args):
+                """Expand fan-out targets, which may be shell style globs.
+                """
+                targets = []
+                for arg in args:
+                        if glob.has_magic(arg):
+                                targets.extend(sorted(glob.glob(arg)))
+                        else:
+                                targets.append(arg)
+                return targets
+
+        def run_script(self, lines, transaction_size=1, stop_on_error=True):
+                """Run SQL read from an iterable of lines, such as an open
+                file, without going through the interactive prompt.
+
+                Statements are committed in transactions of transaction_size
+                statements, or in a single transaction if 0. Special commands
+                (e.g. \\format csv) are allowed on lines of their own.
+                If stop_on_error is True the first failing statement rolls
+                back the current transaction and stops the script.
+                A summary is written to STDERR, and True returned if every
+                statement succeeded.
+                """
+                splitter = StatementSplitter()
+                started = time.time()
+                statements = failed = rows = uncommitted = 0
+
+                def statements_from(lines):
+                        for line in lines:
+                                if not splitter.pending and line.startswith('\\'):
+                                        self.onecmd(line.strip())
+                                        continue
+                                for statement in splitter.feed(line):
+                                        yield statement
+                        remainder = splitter.buffer.strip()
+                        if remainder:
+                                yield remainder
+
+                for statement in statements_from(lines):
+                        statements += 1
+                        count = self.run_query(statement, False)
+                        if count is None:
+                                failed += 1
+                                if stop_on_error:
+                                        self.rollback()
+                                        uncommitted = 0
+                                        break
+                                continue
+                        rows += count
+                        uncommitted += 1
+                        if transaction_size and uncommitted >= transaction_size:
+                                self.commit()
+                                uncommitted = 0
+                if uncommitted:
+                        self.commit()
+
+                elapsed = time.time() - started
+                print >> sys.stderr, "%d statements (%d failed), %d rows in %.3fs, %.1f statements/s" % (
+                        statements, failed, rows, elapsed, statements / (elapsed or 1e-9),)
+                return not failed
+
+        def run_batch(self, sql=None, path=None, transaction_size=1, stop_on_error=True):
+                """Non-interactive entry point for CLI scripts, runs the SQL
+                in sql and/or the file at path ('-' for STDIN) via
+                run_script(), returning True if every statement succeeded.
+                """
+                ok = True
+                if sql:
+                        ok = self.run_script(sql.splitlines(True), transaction_size, stop_on_error)
+                if path and (ok or not stop_on_error):
+                        if path == '-':
+                                f = sys.stdin
+                        else:
+                                try:
+                                        f = open(path, 'rU')
+                                except IOError, e:
+                                        error(e, False)
+                                        return False
+                        try:
+                                ok = self.run_script(f, transaction_size, stop_on_error) and ok
+                        finally:
+                                if f is not sys.stdin:
+                                        f.close()
+                return ok
+
+        def commit(self):
+                """Commit the current transaction, if the cursor's
+                connection is known.
+                """
+                connection = getattr(self.cursor, 'connection', None)
+                if connection is not None:
+                        connection.commit()
+
+        def rollback(self):
+                """Roll back the current transaction, if the cursor's
+                connection is known.
+                """
+                connection = getattr(self.cursor, 'connection', None)
+                if connection is not None:
+                        connection.rollback()
+
+        @property
+        def metadata_namespace(self):
+                """Namespace of the current connection's metadata, the
+                data_cache's own if it has one (e.g. a MetadataCache),
+                otherwise from cache_namespace().
+                """
+                try:
+                        return self.data_cache.namespace
+                except AttributeError:
+                        if self.current_dsn is None:
+                                return None
+                        return self.cache_namespace(self.current_dsn)
+
+        @property
+        def catalog_namespace(self):
+                """Namespace used for this connection's entries in the
+                persistent catalog.
+                """
+                return '%s:%s' % (self.__class__.__name__, self.metadata_namespace,)
+
+        def metadata_miss(self, fn, key, args, kwargs):
+                """Called by memoized on a data_cache miss, to get the
+                value from the persistent catalog if there is one, or
+                by calling fn. Catalog entries older than
+                catalog_refresh_age are refreshed in the background.
+                """
+                if self.catalog is None:
+                        return fn(self, *args, **kwargs)
+                namespace = self.catalog_namespace
+                entry = self.catalog.get(namespace, key)
+                if entry is None:
+                        value = fn(self, *args, **kwargs)
+                        self.catalog.set(namespace, key, value)
+                        return value
+                value, updated = entry
+                if time.time() - updated > self.catalog_refresh_age:
+                        self.refresh_metadata(fn, key, args, kwargs)
+                return value
+
+        def refresh_metadata(self, fn, key, args, kwargs):
+                """Re-run the metadata method fn in a background thread, on a
+                cursor of its own from new_cursor(), and store the result in
+                the catalog. The result is passed back to the main thread via
+                a queue and picked up by precmd().
+                """
+                try:
+                        cursor = self.new_cursor()
+                except NotImplementedError:
+                        return
+                namespace = self.metadata_namespace
+                catalog_namespace = self.catalog_namespace
+                worker = self.detached(cursor)
+                def run():
+                        try:
+                                value = fn(worker, *args, **kwargs)
+                        except Exception:
+                                return
+                        finally:
+                                cursor.connection.close()
+                        self.catalog.set(catalog_namespace, key, value)
+                        self._refreshed.put((namespace, key, value))
+                thread = threading.Thread(target=run)
+                thread.daemon = True
+                thread.start()
+
+        def detached(self, cursor):
+                """Returns a shallow copy of this instance using cursor, for
+                running metadata methods off the main thread. The copy has an
+                empty, uncatalogued data_cache of its own, switched to the
+                same namespace.
+                """
+                worker = copy.copy(self)
+                worker.cursor = worker.system_cursor = cursor
+                worker.data_cache = MetadataCache(self.cache_size, self.cache_ttl)
+                worker.data_cache.switch(self.metadata_namespace)
+                worker.catalog = None
+                return worker
+
+        def invalidate_metadata(self):
+                """Throw away cached and catalogued metadata for the
+                current connection, e.g. after DDL.
+                """
+                self.data_cache.clear()
+                if self.catalog is not None:
+                        self.catalog.clear(self.catalog_namespace)
+                self.completer.model = None
+
+        def start_prefetch(self):
+                """Load the schema model for tab completion in a background
+                thread, on a cursor from new_cursor(), so the prompt isn't
+                blocked. The model is also handed back to the main thread
+                to go in data_cache.
+                Returns False if new_cursor() isn't supported, or loading
+                already failed in the background for this connection.
+                """
+                if self._prefetching:
+                        return True
+                namespace = self.metadata_namespace
+                if namespace in self._prefetch_failed:
+                        return False
+                try:
+                        cursor = self.new_cursor()
+                except NotImplementedError:
+                        return False
+                self._prefetching = True
+                worker = self.detached(cursor)
+                worker.catalog = self.catalog
+                completer = self.completer
+                def run():
+                        try:
+                                model = worker.get_schema_model()
+                                completer.load(model)
+                                self._refreshed.put((namespace, ('get_schema_model', (), ()), model))
+                        except Exception:
+                                # Don't retry on every Tab, completedefault()
+                                # falls back to loading in the foreground
+                                self._prefetch_failed.add(namespace)
+                        finally:
+                                cursor.connection.close()
+                                self._prefetching = False
+                thread = threading.Thread(target=run)
+                thread.daemon = True
+                thread.start()
+                return True
+
+        def preloop(self):
+                """Overridden Cmd.preloop to start loading completions.
+                """
+                self.start_prefetch()
+
+        def completenames(self, text, *ignored):
+                """Overridden Cmd.completenames, to complete SQL keywords and
+                \\ prefixed special commands at the start of a line.
+                """
+                if text.startswith('\\'):
+                        return ['\\' + c for c in self.special_cmds if c.startswith(text[1:])]
+                names = [n for n in cmd.Cmd.completenames(self, text, *ignored)
+                         if n not in self.special_cmds]
+                return names + self.completedefault(text, text, 0, len(text))
+
+        def completedefault(self, text, line, begidx, endidx):
+                """Overridden Cmd.completedefault, to complete SQL keywords,
+                table names and column names. If the schema model hasn't been
+                loaded in the background yet, only keywords are completed.
+                """
+                if self.completer.model is None and not self.start_prefetch():
+                        # No background loading, load it in the foreground
+                        try:
+                                self.completer.load(self.get_schema_model())
+                        except Exception:
+                                pass
+                return self.completer.complete(text, line, begidx)
+
+        def complete_d(self, text, line, begidx, endidx):
+                return self.completer.tables.complete(text, self.completer.limit)
+
+        def precmd(self, line):
+                """Overridden Cmd.precmd to pick up metadata refreshed by
+                background threads, and close idle pooled connections.
+                """
+                self.pool.prune(self.current_dsn)
+                while True:
+                        try:
+                                namespace, key, value = self._refreshed.get_nowait()
+                        except Empty:
+                                break
+                        if namespace == self.metadata_namespace:
+                                self.data_cache[key] = value
+                return line
+
         def get_schemas(self, profile_id):
                 """Helper method to get a list of available schemas/DBs.
                 """
@@ -228,26 +1792,111 @@ Clear cache of profiles, templates, tables and table columns.
 
         def get_tables(self):
                 """Helper method to return a list of tables
-                for the current schema, from the internal
-                DBAPI cursor.
+                for the current schema, from the schema model.
                 """
-                raise NotImplementedError
+                tables = [['Table name',],]
+                for name in self.get_schema_model().table_names():
+                        tables.append([name])
+                return tables
 
         def get_columns(self, table):
                 """Helper method to return a list of column metadata
-                for a given table.
+                for a given table, from the schema model.
+                """
+                columns = [['Column name', 'Type', 'Size', 'Nullable', 'Key',]]
+                for c in self.get_schema_model().columns(table):
+                        columns.append([c.name, c.type, c.size is not None and c.size or '',
+                                        c.nullable is not None and (c.nullable and 'yes' or 'no') or '',
+                                        c.primary_key and 'PK' or '',])
+                return columns
+
+        @memoized()
+        def get_schema_model(self):
+                """Helper method to return the pyDBCLI.schema.SchemaModel
+                for the current schema, cached like other metadata.
+                """
+                return self.load_schema()
+
+        def load_schema(self):
+                """Helper method to load every table and column in the
+                current schema, in as few queries as possible, returning a
+                pyDBCLI.schema.SchemaModel.
                 """
                 raise NotImplementedError
 
         def connect(self, dsn):
-                """Perform connection to another DB and set cursor(s).
+                """Perform connection to another DB and set cursor(s),
+                reusing an open connection from self.pool if there is one,
+                otherwise opening one with open_connection().
+                Returns True if connected.
+                """
+                if self.current_dsn is not None:
+                        self.pool.touch(self.current_dsn)
+                try:
+                        conn = self.pool.get(dsn, lambda: self.open_connection(dsn))
+                        self.cursor = self.system_cursor = conn.cursor()
+                except Exception, e:
+                        error(e, False)
+                        return False
+                self._connection = conn
+                self.current_dsn = dsn
+                if hasattr(self.data_cache, 'switch'):
+                        self.data_cache.switch(self.cache_namespace(dsn))
+                else:
+                        # A plain dict only holds one connection's metadata
+                        self.data_cache.clear()
+                return True
+
+        def open_connection(self, dsn):
+                """Open a new DBAPI connection to dsn.
                 """
                 raise NotImplementedError
 
+        def cache_namespace(self, dsn):
+                """Returns the data_cache (and catalog) namespace for dsn.
+                """
+                return dsn
+
+        def new_cursor(self):
+                """Open a new connection to the current DB, returning a
+                cursor on it, for use off the main thread. Optional, raises
+                NotImplementedError if not supported.
+                """
+                return self.open_connection(self.current_dsn).cursor()
+
         @property
         def special_cmds_re(self):
-            return re.compile('^[\\\\]([%s])(\\s|$)(.*)' % (''.join(self.special_cmds),))
+            return self._dispatch_res()[0]
 
         @property
         def unesc_special_cmds_re(self):
-            return re.compile('^([%s])(\\s|$)(.*)' % (''.join(self.special_cmds),))
+            return self._dispatch_res()[1]
+
+        def _dispatch_res(self):
+            # Compiled once per class and set of special commands (which
+            # can still be added to after the class is defined), rather
+            # than for every line
+            cmds = tuple(self.special_cmds) + tuple(registry.commands.names())
+            key = (self.__class__, cmds)
+            res = _dispatch_res.get(key)
+            if res is None:
+                alt = self._special_cmds_alt(cmds)
+                res = _dispatch_res[key] = (re.compile('^[\\\\](%s)(\\s|$)(.*)' % (alt,)),
+                                            re.compile('^(%s)(\\s|$)(.*)' % (alt,)))
+            return res
+
+        def _special_cmds_alt(self, cmds=None):
+            # Longest first, so e.g. \dc isn't matched as \d
+            cmds = sorted(cmds or self.special_cmds, key=len, reverse=True)
+            return '|'.join([re.escape(c) for c in cmds])
+
+        def __getattr__(self, name):
+            # do_<name> for special commands in pyDBCLI.registry.commands,
+            # only imported once used
+            if name.startswith('do_') and name[3:] in registry.commands:
+                return types.MethodType(registry.commands.get(name[3:]), self)
+            raise AttributeError(name)
+
+        def get_names(self):
+            # Overridden Cmd.get_names so \help lists registered commands
+            return cmd.Cmd.get_names(self) + ['do_%s' % (name,) for name in registry.commands.names()]
@@ -0,0 +1,140 @@
+#-*- coding: utf-8 -*-
+
+"""Diffs between successive results of a query re-run on an interval,
+see \\watch
+"""
+__author__ = 'Wes Mason <wes[at]1stvamp[dot]org>'
+__docformat__ = 'restructuredtext en'
+__version__ = '0.1'
+
+# Markers in the first column of a diff
+ADDED = '+'
+REMOVED = '-'
+CHANGED = '~'
+
+_numeric_types = (int, long, float)
+
+
+def delta(new, old):
+        """Returns new formatted with the difference from old, if they're
+        both numbers, e.g. '12 (+3)', otherwise new unchanged.
+        """
+        if (type(new) in _numeric_types and type(old) in _numeric_types
+                        and new != old):
+                if isinstance(new, float) or isinstance(old, float):
+                        return '%s (%+g)' % (new, new - old)
+                return '%s (%+d)' % (new, new - old)
+        return new
+
+
+class ResultDiff(object):
+        """The last result of a watched query, as a dict of rows by key, to
+        diff the next result against a batch at a time. Rows are keyed by
+        the values of key_columns (names or 1 based positions) if given,
+        so changes to a row show as changed with deltas, otherwise by the
+        whole row, so they show as removed and added.
+        Only the first max_rows rows of each result are kept and compared.
+        """
+
+        def __init__(self, keys, key_columns=(), max_rows=None):
+                self.keys = list(keys)
+                self.max_rows = max_rows
+                self.rows = {}
+                self.count = 0
+                self.truncated = False
+                self.added = self.removed = self.changed = 0
+                self.key_indexes = [self.column(c) for c in key_columns]
+
+        def column(self, name):
+                """Returns the index of the column called name (case
+                insensitive), or at 1 based position name.
+                """
+                if name.isdigit() and 0 < int(name) <= len(self.keys):
+                        return int(name) - 1
+                lowered = [k.lower() for k in self.keys]
+                name = name.strip('"`[]').lower()
+                if name in lowered:
+                        return lowered.index(name)
+                raise KeyError(name)
+
+        def key(self, row):
+                if self.key_indexes:
+                        return tuple(row[i] for i in self.key_indexes)
+                return row
+
+        def _store(self, batches):
+                """Generator yielding each of batches with a list of (row,
+                previous row or None) for its rows to keep, building a new
+                dict of rows which replaces the last one once they've all
+                been read. Rows matched are taken out of the last one.
+                """
+                rows = {}
+                count = 0
+                truncated = False
+                old = self.rows
+                keyed = bool(self.key_indexes)
+                max_rows = self.max_rows
+                for batch in batches:
+                        pairs = []
+                        for row in batch:
+                                count += 1
+                                if max_rows is not None and count > max_rows:
+                                        truncated = True
+                                        continue
+                                row = tuple(row)
+                                key = self.key(row)
+                                if keyed:
+                                        rows[key] = row
+                                        pairs.append((row, old.pop(key, None)))
+                                else:
+                                        # Whole rows are keys, so count repeats
+                                        rows[key] = rows.get(key, 0) + 1
+                                        seen = old.get(key, 0)
+                                        if seen:
+                                                old[key] = seen - 1
+                                        pairs.append((row, seen and row or None))
+                        yield batch, pairs
+                self.rows = rows
+                self.count = count
+                self.truncated = truncated
+
+        def track(self, batches):
+                """Generator passing row batches through, keeping their rows
+                to diff the next result against.
+                """
+                for batch, pairs in self._store(batches):
+                        yield batch
+
+        def diff(self, batches, batch_size=1000):
+                """Generator yielding batches of the rows added, removed or
+                changed since the last result, each with a marker column
+                (ADDED, REMOVED or CHANGED) first and numeric columns of
+                changed rows showing their delta, see delta().
+                """
+                self.added = self.removed = self.changed = 0
+                old = self.rows
+                changes = []
+                for batch, pairs in self._store(batches):
+                        for row, previous in pairs:
+                                if previous is None:
+                                        changes.append((ADDED,) + row)
+                                        self.added += 1
+                                elif previous != row:
+                                        changes.append((CHANGED,) + tuple(delta(n, o) for (n, o) in zip(row, previous)))
+                                        self.changed += 1
+                        if len(changes) >= batch_size:
+                                yield changes
+                                changes = []
+                # Whatever's left of the last result wasn't seen this time
+                if self.key_indexes:
+                        removed = old.itervalues()
+                else:
+                        removed = (row for (row, n) in old.iteritems() for i in xrange(n))
+                for row in removed:
+                        changes.append((REMOVED,) + row)
+                        self.removed += 1
+                        if len(changes) >= batch_size:
+                                yield changes
+                                changes = []
+                if changes:
+                        yield changes
@@ -17,5 +17,8 @@ setup(
     extras_require={
         'odbc': ['pyodbc>=2.0',],
     },
+    entry_points={
+        'console_scripts': ['pydbcli = pyDBCLI.cli:main',],
+    },
     license='Apache License 2.0'
 )